@@ -1,3 +1,5 @@
+import json
+
 import dash
 import dash_table
 import dash_core_components as dcc
@@ -7,39 +9,79 @@ import pandas as pd
 import plotly.graph_objects as go
 from dash.dependencies import Input, Output, ALL, State
 from dash.exceptions import PreventUpdate
-from utility import functions
+from flask import Response
+from utility import api, functions, metrics, profiling, snapshot, warmup
+from utility import store as server_store
 
 external_stylesheets = [dbc.themes.BOOTSTRAP]
 
+# Specify teams and load in data (memory mapped season snapshot, raw JSON is not parsed)
+season = snapshot.get_snapshot()
+teams = tuple(season.meta['teams'])
+
+# League shape, e.g. 20 teams and 38 gameweeks
+n_gameweeks = season.meta['n_gameweeks']
+n_pairs = len(teams) * (len(teams) - 1) // 2
+
 # Specify gameweeks for exclusion dropdown
 gw = []
-for i in range(1, 39):
+for i in range(1, n_gameweeks + 1):
     x = {'label': i, 'value': i}
     gw.append(x)
 
-# Specify teams and load in data
-data, fixtures = functions.load_data()
-teams = functions.get_teams(data)
-
 teams_list = []
 for i in teams:
     teams_stage = {'label': i, 'value': i}
     teams_list.append(teams_stage)
 
-# Get current gameweek:
-current_gw = 38
-for i in data['events']:
-    if i['is_next']:
-        current_gw = i['id']
-
-end_gw = 35
-if current_gw >= 35:
-    end_gw = 38
-if current_gw < 10:
-    end_gw = 18
+# Get current gameweek and the default window:
+current_gw, end_gw = functions.default_window(n_gameweeks, season.meta['next_gameweek'])
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
+# WSGI application, e.g. gunicorn app:server (see gunicorn.conf.py)
+server = app.server
+
+# Results are kept server side, the browser only holds the result key and parameters
+result_store = server_store.ResultStore()
+
+hidden_data_bytes = metrics.Histogram('fpl_hidden_data_bytes', 'Size of the hidden-data store sent to the browser',
+                                      buckets=metrics.SIZE_BUCKETS)
+
+
+# JSON API for bots and integrations, see utility/api.py
+app.server.register_blueprint(api.blueprint)
+
+# Opt-in callback profiling, see utility/profiling.py
+profiling.init_app(app.server)
+
+# Precompute the default views in the background, see utility/warmup.py
+warmup.init_app(app.server)
+
+
+# Prometheus metrics of this worker process
+@app.server.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Result parts from the hidden data if the server side store failed when the result was saved, otherwise from the
+# store. Expired parts are calculated again from the current snapshot and stored under that snapshot's key.
+def load_result_parts(hidden_data, names):
+    if 'parts' in hidden_data:
+        return server_store.parts_from_json(hidden_data['parts'], names)
+
+    parts = result_store.get(hidden_data['result_key'], names)
+    if parts is None:
+        season = snapshot.get_snapshot()
+        result = functions.complimenting_fixtures_calc(**hidden_data['params'], season=season)
+        all_parts = server_store.result_parts(result)
+        result_store.put(server_store.result_key(season.id, functions.canonical_params(**hidden_data['params'])),
+                         all_parts)
+        parts = {name: all_parts[name] for name in names}
+    return parts
+
+
 intro = html.Div(
     [
         dbc.Row([
@@ -124,20 +166,10 @@ select_inputs = html.Div(children=[
                 id='gw-select',
                 count=1,
                 min=1,
-                max=38,
+                max=n_gameweeks,
                 step=1,
                 value=[current_gw, end_gw],
-                marks={
-                    1: '1',
-                    5: '5',
-                    10: '10',
-                    15: '15',
-                    20: '20',
-                    25: '25',
-                    30: '30',
-                    35: '35',
-                    38: '38'
-                }),
+                marks={i: str(i) for i in [1] + list(range(5, n_gameweeks, 5)) + [n_gameweeks]}),
             html.I(id='gw-selected', style={'text-align': 'right'})])
     ]),
     dbc.Row(children=[
@@ -219,11 +251,11 @@ output = html.Div(children=[
             dcc.Slider(
                 id='table-limit',
                 min=0,
-                max=190,
+                max=n_pairs,
                 value=10,
                 marks={
                     1: '1',
-                    190: '190'
+                    n_pairs: str(n_pairs)
                 }
             ),
             html.H6('Filter Output by Team'),
@@ -237,6 +269,77 @@ output = html.Div(children=[
     ])
 ])
 
+rotations = html.Div(children=[
+    dbc.Row(children=[
+        dbc.Col(width=11, children=[
+            html.H4('Team Rotations Ordered')
+        ])
+    ]),
+
+    dbc.Row(children=[
+        dbc.Col(width=4, children=[
+            dcc.Loading(type="circle", children=[
+                html.Div(id='table-holder-rotation', children=[
+                    ''
+                ]
+                         )
+            ])
+        ]),
+        dbc.Col(width=4, children=[
+            html.H6('Select number of teams to rotate'),
+            dcc.Dropdown(
+                id='rotation-size',
+                options=[{'label': i, 'value': i} for i in (3, 4, 5)],
+                value=3,
+                clearable=False
+            ),
+            html.H6('Select number of teams playing each gameweek'),
+            dcc.Dropdown(
+                id='rotation-best-of',
+                options=[{'label': i, 'value': i} for i in (1, 2)],
+                value=1,
+                clearable=False
+            )
+        ])
+    ])
+])
+
+player_pairs = html.Div(children=[
+    dbc.Row(children=[
+        dbc.Col(width=11, children=[
+            html.H4('Player Pairs Ordered')
+        ])
+    ]),
+
+    dbc.Row(children=[
+        dbc.Col(width=6, children=[
+            dcc.Loading(type="circle", children=[
+                html.Div(id='table-holder-player', children=[
+                    ''
+                ]
+                         )
+            ])
+        ]),
+        dbc.Col(width=4, children=[
+            html.H6('Select position'),
+            dcc.Dropdown(
+                id='player-position',
+                options=[{'label': i, 'value': i} for i in season.meta['positions']],
+                value=season.meta['positions'][0],
+                clearable=False
+            ),
+            html.H6('Maximum cost of both players (£m)'),
+            dcc.Input(
+                id='player-budget',
+                type="number",
+                min=0,
+                step=0.1,
+                placeholder='No limit'
+            )
+        ])
+    ])
+])
+
 compare_fixtures = html.Div(children=[
     dbc.Row(children=[
         dbc.Col(width=11, children=[
@@ -306,6 +409,10 @@ app.layout = dbc.Container([
     html.Hr(),
     output,
     html.Hr(),
+    rotations,
+    html.Hr(),
+    player_pairs,
+    html.Hr(),
     compare_fixtures,
 ])
 
@@ -313,6 +420,7 @@ app.layout = dbc.Container([
 @app.callback(
     Output(component_id='custom_kpi_holder', component_property='style'),
     Input(component_id='kpi-select', component_property='value'))
+@metrics.timed('show_hide_element', metrics.callback_seconds)
 def show_hide_element(kpi_select):
     if kpi_select == 'custom_kpi':
         return {'display': 'block', 'columnCount': 5}
@@ -325,6 +433,7 @@ def show_hide_element(kpi_select):
     Output(component_id='custom-kpi-text', component_property='children'),
     Input(component_id='kpi-select', component_property='value')
 )
+@metrics.timed('custom_kpi_text', metrics.callback_seconds)
 def update_output(kpi_select):
     if kpi_select == 'custom_kpi':
         to_return = [html.I(children=['Enter a value for each team. E.g. goals per game this season'])]
@@ -337,6 +446,7 @@ def update_output(kpi_select):
     Output(component_id='gw-selected', component_property='children'),
     Input(component_id='gw-select', component_property='value')
 )
+@metrics.timed('gw_selected', metrics.callback_seconds)
 def update_output(value):
     return f'Gameweeks {str(value[0])} to {str(value[1])} selected'
 
@@ -357,6 +467,7 @@ def update_output(value):
     [State(component_id='hidden-data', component_property='data'),
      State(component_id='table-limit', component_property='value'), ]
 )
+@metrics.timed('generate_table', metrics.callback_seconds)
 def generate_table(kpi_selected, mgw_bgw, exclude_specific_gws, slider_vals, custom_kpi_input,
                    hidden_data, val):
     # Only calculate if all values are submitted
@@ -381,33 +492,42 @@ def generate_table(kpi_selected, mgw_bgw, exclude_specific_gws, slider_vals, cus
         if item == None:
             custom_kpi_input[idx] = 0
     custom_kpi = {}
-    for i in range(0, 20):
+    for i in range(0, len(teams)):
         custom_kpi[teams[i]] = custom_kpi_input[i]
 
-    df, fix_val, fix_name, mgw, bgw, max_val, all_fixture_vals = functions.complimenting_fixtures_calc(kpi_selected,
-                                                                                                       custom_kpi,
-                                                                                                       start_gameweek,
-                                                                                                       end_gameweek,
-                                                                                                       exclude_gameweeks,
-                                                                                                       skip_multi_gameweeks,
-                                                                                                       skip_blank_gameweeks)
+    params = {'kpi': kpi_selected,
+              'custom_kpi': custom_kpi,
+              'start_gameweek': start_gameweek,
+              'end_gameweek': end_gameweek,
+              'exclude_gameweeks': exclude_gameweeks,
+              'skip_multi_gameweeks': skip_multi_gameweeks,
+              'skip_blank_gameweeks': skip_blank_gameweeks}
+
+    season = snapshot.get_snapshot()
+    result = functions.complimenting_fixtures_calc(**params, season=season)
+    mgw, bgw = result[3], result[4]
 
     # if team_filter != 'ALL':
     #     df = df[(df['TEAM_1'] == team_filter) | (df['TEAM_2'] == team_filter)]
 
-    hidden_data['fixtures_pair'] = df.to_json()
-    hidden_data['kpi_selected'] = kpi_selected
-    hidden_data['fix_val'] = fix_val
-    hidden_data['fix_name'] = fix_name
-    hidden_data['mgw'] = mgw
-    hidden_data['bgw'] = bgw
-    hidden_data['max_val'] = max_val
-    hidden_data['skip_multi_gameweeks'] = skip_multi_gameweeks
-    hidden_data['skip_blank_gameweeks'] = skip_blank_gameweeks
-    hidden_data['start_gameweek'] = start_gameweek
-    hidden_data['end_gameweek'] = end_gameweek
-    hidden_data['exclude_gameweeks'] = exclude_gameweeks
-    hidden_data['all_fixture_vals'] = all_fixture_vals.to_json()
+    # Save the result server side under a key shared by all workers
+    result_key = server_store.result_key(season.id, functions.canonical_params(**params))
+    parts = server_store.result_parts(result)
+    stored = result_store.put(result_key, parts)
+
+    hidden_data = {'result_key': result_key,
+                   'params': params,
+                   'kpi_selected': kpi_selected,
+                   'skip_multi_gameweeks': skip_multi_gameweeks,
+                   'skip_blank_gameweeks': skip_blank_gameweeks,
+                   'start_gameweek': start_gameweek,
+                   'end_gameweek': end_gameweek,
+                   'exclude_gameweeks': exclude_gameweeks}
+
+    # The browser keeps the result if the store is failing
+    if not stored:
+        hidden_data['parts'] = server_store.parts_to_json(parts)
+    hidden_data_bytes.observe(len(json.dumps(hidden_data)))
 
     # Print gameweeks removing
     all_gws_excluded = []
@@ -437,11 +557,12 @@ def generate_table(kpi_selected, mgw_bgw, exclude_specific_gws, slider_vals, cus
     Input(component_id='team-filter', component_property='value'),
     [State(component_id='hidden-data', component_property='data')]
 )
+@metrics.timed('select_column_row', metrics.callback_seconds)
 def select_column_row(table_limit, team_filter, hidden_data):
     # but did we even click on anything??
-    if dash.callback_context.triggered[0]['prop_id'] == '.':
+    if dash.callback_context.triggered[0]['prop_id'] == '.' or not hidden_data:
         raise PreventUpdate
-    df = pd.read_json(hidden_data['fixtures_pair'])
+    df = load_result_parts(hidden_data, ['fixtures_pair'])['fixtures_pair']
 
     if team_filter is None:
         df = df.head(table_limit)
@@ -462,6 +583,74 @@ def select_column_row(table_limit, team_filter, hidden_data):
     )
 
 
+@app.callback(
+    [Output(component_id='rotation-best-of', component_property='options'),
+     Output(component_id='rotation-best-of', component_property='value')],
+    Input(component_id='rotation-size', component_property='value'),
+    [State(component_id='rotation-best-of', component_property='value')]
+)
+@metrics.timed('update_rotation_best_of', metrics.callback_seconds)
+def update_rotation_best_of(group_size, best_of):
+    # At least one team of the rotation is on the bench each gameweek
+    options = [{'label': i, 'value': i} for i in range(1, group_size)]
+    return options, min(best_of or 1, group_size - 1)
+
+
+@app.callback(
+    Output(component_id='table-holder-rotation', component_property='children'),
+    Input(component_id='rotation-size', component_property='value'),
+    Input(component_id='rotation-best-of', component_property='value'),
+    Input(component_id='hidden-data', component_property='data')
+)
+@metrics.timed('generate_rotation_table', metrics.callback_seconds)
+def generate_rotation_table(group_size, best_of, hidden_data):
+    if not hidden_data:
+        raise PreventUpdate
+
+    df = functions.rotation_calc(**hidden_data['params'], group_size=group_size, best_of=min(best_of, group_size))
+
+    df = df.rename(columns=lambda i: i.replace('TEAM_', 'Team ').title())
+
+    return dash_table.DataTable(
+        id='df-rotation',
+        columns=[
+            {"name": i, "id": i} for i in df.columns
+        ],
+        style_cell={'textAlign': 'center'},
+        data=df.to_dict(orient='records'),
+        page_size=10,
+        export_format="csv"
+    )
+
+
+@app.callback(
+    Output(component_id='table-holder-player', component_property='children'),
+    Input(component_id='player-position', component_property='value'),
+    Input(component_id='player-budget', component_property='value'),
+    Input(component_id='hidden-data', component_property='data')
+)
+@metrics.timed('generate_player_table', metrics.callback_seconds)
+def generate_player_table(position, budget, hidden_data):
+    if not hidden_data:
+        raise PreventUpdate
+
+    df = functions.player_pair_calc(**hidden_data['params'], positions=[position], budget=budget)
+
+    # Results are shared through the cache, rename a copy
+    df = df.set_axis(['Player 1', 'Team 1', 'Player 2', 'Team 2', 'Cost', 'Value'], axis=1)
+
+    return dash_table.DataTable(
+        id='df-player',
+        columns=[
+            {"name": i, "id": i} for i in df.columns
+        ],
+        style_cell={'textAlign': 'center'},
+        data=df.to_dict(orient='records'),
+        page_size=10,
+        export_format="csv"
+    )
+
+
 @app.callback(
     [Output(component_id='table-holder-fix', component_property='children'),
      Output(component_id="line-chart", component_property="figure")],
@@ -469,33 +658,20 @@ def select_column_row(table_limit, team_filter, hidden_data):
     Input(component_id='team-fix-2', component_property='value'),
     Input(component_id='hidden-data', component_property='data')
 )
+@metrics.timed('generate_fixture_output', metrics.callback_seconds)
 def generate_fixture_output(team1, team2, hidden_data):
     # but did we even click on anything??
-    if dash.callback_context.triggered[0]['prop_id'] == '.':
+    if dash.callback_context.triggered[0]['prop_id'] == '.' or not hidden_data:
         raise PreventUpdate
 
     kpi_selected = hidden_data['kpi_selected']
-    fix_val = hidden_data['fix_val']
-    fix_name = hidden_data['fix_name']
-    mgw = hidden_data['mgw']
-    bgw = hidden_data['bgw']
-    max_val = hidden_data['max_val']
-    skip_multi_gameweeks = hidden_data['skip_multi_gameweeks']
-    skip_blank_gameweeks = hidden_data['skip_blank_gameweeks']
-    start_gameweek = hidden_data['start_gameweek']
-    end_gameweek = hidden_data['end_gameweek']
-    exclude_gameweeks = hidden_data['exclude_gameweeks']
-    all_fixture_vals = pd.read_json(hidden_data['all_fixture_vals'])
-
-    print(kpi_selected)
-
-    fix_name, fix_val = functions.prep_fixture_output(fix_name, fix_val, team1, team2, mgw, max_val)
-
-    fix_name = functions.filter_fixtures(fix_name, start_gameweek, end_gameweek, exclude_gameweeks,
-                                         skip_multi_gameweeks,
-                                         skip_blank_gameweeks, mgw, bgw)
+
+    fix_name, _, _, _ = functions.compare_teams(**hidden_data['params'], team1=team1, team2=team2)
     fix_name = fix_name.replace('BGW', '-')
 
+    parts = load_result_parts(hidden_data, [f'all_fixture_vals/{team}' for team in (team1, team2)])
+    all_fixture_vals = pd.DataFrame({team: parts[f'all_fixture_vals/{team}'] for team in (team1, team2)})
+
     fix_name_disct_cols = functions.rename_columns(fix_name.copy())
 
     # Add index as first column with no column title
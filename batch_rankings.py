@@ -0,0 +1,49 @@
+import argparse
+import importlib.util
+import json
+
+from utility import batch, model, snapshot
+
+# Include (no), skip (yes) or both for the multi / blank gameweek options
+SKIP_CHOICES = {'include': [False], 'skip': [True], 'both': [False, True]}
+
+parser = argparse.ArgumentParser(description='Rank team pairs for every combination of a parameter grid')
+parser.add_argument('output', help='File to write, .csv or .parquet')
+parser.add_argument('--kpis', default=','.join(model.KPIS),
+                    help='Comma separated KPIs (custom_kpi needs --custom-kpi), default all built-in KPIs')
+parser.add_argument('--starts', default=None, help='Window start gameweeks, e.g. 1-38 or 1,5,10 (default all)')
+parser.add_argument('--lengths', default='1-10', help='Window lengths in gameweeks, e.g. 1-10 (default 1-10)')
+parser.add_argument('--mgw', choices=SKIP_CHOICES, default='both', help='Multi gameweeks: include, skip or both')
+parser.add_argument('--bgw', choices=SKIP_CHOICES, default='both', help='Blank gameweeks: include, skip or both')
+parser.add_argument('--custom-kpi', metavar='FILE', help='JSON file of team short name to custom KPI value')
+parser.add_argument('--top', type=int, help='Only write the best TOP pairs of each combination')
+parser.add_argument('--workers', type=int, help='Worker processes (default number of CPUs)')
+args = parser.parse_args()
+
+if args.output.endswith('.parquet') and importlib.util.find_spec('pyarrow') is None:
+    parser.error('writing Parquet needs pyarrow (pip install pyarrow), or write a .csv file instead')
+
+season = snapshot.get_snapshot()
+n_gameweeks = season.meta['n_gameweeks']
+kpis = [i.strip() for i in args.kpis.split(',') if i.strip()]
+
+unknown = set(kpis) - set(model.KPIS + ('custom_kpi',))
+if unknown:
+    parser.error(f'unknown KPIs {", ".join(sorted(unknown))}, choose from {", ".join(model.KPIS)} or custom_kpi')
+
+custom_kpi = None
+if args.custom_kpi:
+    with open(args.custom_kpi) as f:
+        values = json.load(f)
+    custom_kpi = {team: values.get(team, 0) for team in season.meta['teams']}
+elif 'custom_kpi' in kpis:
+    parser.error('custom_kpi needs --custom-kpi')
+
+grid = batch.parameter_grid(kpis,
+                            batch.parse_range(args.starts or f'1-{n_gameweeks}'),
+                            batch.parse_range(args.lengths),
+                            SKIP_CHOICES[args.mgw],
+                            SKIP_CHOICES[args.bgw],
+                            n_gameweeks)
+
+batch.run(grid, args.output, custom_kpi=custom_kpi, top=args.top, workers=args.workers)
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from utility import functions, snapshot
+
+RESULTS_PATH = 'benchmarks/results.json'
+BASELINE_PATH = 'benchmarks/baseline.json'
+
+# A stage has regressed if its median time grew by more than this fraction (and by more than MIN_DIFFERENCE seconds)
+THRESHOLD = 0.25
+MIN_DIFFERENCE = 0.0005
+
+
+# Time a function, setup returns its arguments and is not timed (e.g. copies of inputs the function modifies)
+def measure(function, setup=tuple, repeat=5):
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    return {'min': min(times), 'median': statistics.median(times), 'repeat': repeat}
+
+
+# Drop everything derived from the data, so the next call starts from the data files
+def clear_caches():
+    snapshot.reset()
+    functions.clear_caches()
+
+
+# Time each stage of the calculation for the season in the snapshot directories
+def run_stages(repeat):
+    clear_caches()
+    season = snapshot.get_snapshot()
+    teams = season.meta['teams']
+    n_gameweeks = season.meta['n_gameweeks']
+    custom_kpi = {team: 0 for team in teams}
+    calc_args = ('difficulty', custom_kpi, 1, n_gameweeks, [], False, False)
+
+    # Inputs of each stage, from the stage before
+    prepared = functions.prepare_fixtures(season, 'difficulty', custom_kpi)
+    result = functions.complimenting_fixtures_calc(*calc_args)
+    team1, team2 = sorted(teams)[:2]
+    df_name, _ = functions.prep_fixture_output(result[2], result[1], team1, team2, result[3], result[5])
+
+    # A new snapshot: opened (memory mapped) with every KPI prepared by the on_load callbacks
+    def new_snapshot():
+        clear_caches()
+        return ()
+
+    # Setup for a stage with its own result cached in result_cache, keeping the snapshot's ranked pairs
+    def uncached(*args):
+        def setup():
+            functions.result_cache.clear()
+            functions.complimenting_fixtures_calc(*calc_args)
+            return args
+        return setup
+
+    stages = {}
+    stages['get_snapshot'] = measure(snapshot.get_snapshot, new_snapshot, repeat)
+    season = snapshot.get_snapshot()
+    stages['prepare_season'] = measure(functions.prepare_season, lambda: functions.clear_caches() or (season,),
+                                       repeat)
+    functions.prepare_season(season)
+    stages['fixture_calc_indexed'] = measure(functions.fixture_calc_indexed,
+                                             lambda: (prepared, 1, n_gameweeks, [], False, False), repeat)
+    stages['prep_fixture_output'] = measure(functions.prep_fixture_output,
+                                            lambda: (result[2], result[1], team1, team2, result[3], result[5]), repeat)
+    stages['filter_fixtures'] = measure(
+        functions.filter_fixtures,
+        lambda: (df_name.copy(), 1, n_gameweeks, [], False, False, result[3], result[4], n_gameweeks), repeat)
+    stages['compare_teams'] = measure(functions.compare_teams, uncached(*calc_args, team1, team2), repeat)
+    stages['rotation_calc'] = measure(functions.rotation_calc, uncached(*calc_args), repeat)
+    stages['player_pair_calc'] = measure(functions.player_pair_calc, uncached(*calc_args), repeat)
+
+    # End to end: new snapshot, new parameters on a prepared snapshot and a cached result
+    def cold():
+        clear_caches()
+        return calc_args
+
+    def prepared_season():
+        functions.result_cache.clear()
+        return calc_args
+
+    stages['complimenting_fixtures_calc'] = measure(functions.complimenting_fixtures_calc, cold, repeat)
+    stages['complimenting_fixtures_calc (prepared)'] = measure(functions.complimenting_fixtures_calc,
+                                                               prepared_season, repeat)
+    stages['complimenting_fixtures_calc (cached)'] = measure(functions.complimenting_fixtures_calc,
+                                                             lambda: calc_args, repeat)
+
+    shape = {'teams': len(teams), 'gameweeks': n_gameweeks, 'fixtures': len(season.fixtures)}
+    clear_caches()
+
+    return shape, stages
+
+
+# Point the snapshot at other data directories for the duration of a run
+def use_data_directory(directory):
+    snapshot.BOOTSTRAP_STATIC_DIR = os.path.join(directory, 'bootstrap_static')
+    snapshot.FIXTURES_DIR = os.path.join(directory, 'fixtures')
+    snapshot.SNAPSHOT_DIR = os.path.join(directory, 'snapshot')
+
+
+def run(seasons, args):
+    defaults = (snapshot.BOOTSTRAP_STATIC_DIR, snapshot.FIXTURES_DIR, snapshot.SNAPSHOT_DIR)
+    results = {}
+
+    for season in seasons:
+        if season == 'real':
+            config = {}
+            shape, stages = run_stages(args.repeat)
+        else:
+            config = {'teams': args.teams, 'gameweeks': args.gameweeks, 'fixtures': args.fixtures,
+                      'blank_rate': args.blank_rate, 'double_rate': args.double_rate, 'seed': args.seed}
+            data, fixtures = synthetic.generate_season(args.teams, args.gameweeks, args.fixtures, args.blank_rate,
+                                                       args.double_rate, seed=args.seed)
+            with tempfile.TemporaryDirectory() as directory:
+                synthetic.write_season(directory, data, fixtures)
+                use_data_directory(directory)
+                try:
+                    shape, stages = run_stages(args.repeat)
+                finally:
+                    snapshot.BOOTSTRAP_STATIC_DIR, snapshot.FIXTURES_DIR, snapshot.SNAPSHOT_DIR = defaults
+                    clear_caches()
+            season = f'synthetic_{shape["teams"]}x{shape["gameweeks"]}'
+
+        results[season] = {'config': config, 'shape': shape, 'stages': stages}
+        print_stages(season, shape, stages)
+
+    return {'meta': {'date': datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'pandas': pd.__version__,
+                     'machine': platform.machine(),
+                     'cpus': os.cpu_count()},
+            'seasons': results}
+
+
+def print_stages(season, shape, stages):
+    print(f'\n{season} ({shape["teams"]} teams, {shape["gameweeks"]} gameweeks, {shape["fixtures"]} fixtures)')
+    for name, timing in stages.items():
+        print(f'  {name:<45} {timing["median"] * 1000:>10.3f} ms  (min {timing["min"] * 1000:.3f} ms)')
+
+
+# Stages slower than the baseline by more than the threshold, as (season, stage, baseline, current) medians
+def compare(results, baseline, threshold=THRESHOLD, min_difference=MIN_DIFFERENCE):
+    regressions = []
+    for season, result in results['seasons'].items():
+        base = baseline.get('seasons', {}).get(season)
+        if base is None or base.get('config') != result['config']:
+            continue
+        for name, timing in result['stages'].items():
+            if name not in base['stages']:
+                continue
+            before = base['stages'][name]['median']
+            after = timing['median']
+            if after > before * (1 + threshold) and after - before > min_difference:
+                regressions.append((season, name, before, after))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time each stage of the complementing fixtures calculation')
+    parser.add_argument('--seasons', default='real,synthetic',
+                        help='Comma separated seasons to run: real (the data directory) and/or synthetic')
+    parser.add_argument('--teams', type=int, default=20, help='Synthetic season: number of teams')
+    parser.add_argument('--gameweeks', type=int, help='Synthetic season: number of gameweeks (default one per round)')
+    parser.add_argument('--fixtures', type=int, help='Synthetic season: number of fixtures (default home and away)')
+    parser.add_argument('--blank-rate', type=float, default=0.02,
+                        help='Synthetic season: fraction of fixtures moved out of their gameweek')
+    parser.add_argument('--double-rate', type=float, default=0.75,
+                        help='Synthetic season: fraction of moved fixtures played in another gameweek')
+    parser.add_argument('--seed', type=int, default=0, help='Synthetic season: random seed')
+    parser.add_argument('--repeat', type=int, default=5, help='Times to run each stage, the median is compared')
+    parser.add_argument('--output', default=RESULTS_PATH, help='File to save the results as JSON')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Results to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='Fraction a stage may be slower than the baseline before it counts as a regression')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    # Time the calculations, not reads of results other runs left on disk
+    functions.disk_cache = None
+
+    results = run([i.strip() for i in args.seasons.split(',') if i.strip()], args)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nSaved baseline to {args.baseline}')
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except OSError:
+        print(f'\nNo baseline at {args.baseline}, run with --save-baseline to create one')
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print(f'\nNo regressions against {args.baseline} (threshold {args.threshold:.0%})')
+        return 0
+
+    print(f'\nRegressions against {args.baseline} (threshold {args.threshold:.0%}):')
+    for season, name, before, after in regressions:
+        print(f'  {season} {name}: {before * 1000:.3f} ms -> {after * 1000:.3f} ms ({after / before - 1:+.0%})')
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
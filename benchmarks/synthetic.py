@@ -0,0 +1,94 @@
+import json
+import os
+import random
+
+POSITIONS = ('GKP', 'DEF', 'MID', 'FWD')
+
+
+# Round robin rounds (circle method), each round a list of (home, away) team indices
+# Teams with no opponent in a round (odd number of teams) sit it out
+def round_robin(n_teams):
+    teams = list(range(n_teams)) + ([None] if n_teams % 2 else [])
+    rounds = []
+    for _ in range(len(teams) - 1):
+        half = len(teams) // 2
+        pairs = zip(teams[:half], reversed(teams[half:]))
+        rounds.append([(a, b) for a, b in pairs if a is not None and b is not None])
+        teams = [teams[0], teams[-1]] + teams[1:-1]
+    return rounds
+
+
+# Synthetic bootstrap-static and fixtures data in the FPL API format
+# n_fixtures defaults to a double round robin, played over n_gameweeks (default one round per gameweek, extra rounds
+# share gameweeks). blank_rate of the fixtures are moved out of their gameweek, double_rate of those are played in
+# another gameweek (a double gameweek for both teams) and the rest are left unscheduled
+def generate_season(n_teams=20, n_gameweeks=None, n_fixtures=None, blank_rate=0.02, double_rate=0.75,
+                    players_per_team=30, seed=0):
+    rng = random.Random(seed)
+    n_fixtures = n_teams * (n_teams - 1) if n_fixtures is None else n_fixtures
+
+    rounds = round_robin(n_teams)
+    matches = []
+    cycle = 0
+    while len(matches) < n_fixtures and any(rounds):
+        for round_fixtures in rounds:
+            # Every other time round the home and away teams swap
+            matches += [(b, a) if cycle % 2 else (a, b) for a, b in round_fixtures]
+        cycle += 1
+    matches = matches[:n_fixtures]
+
+    per_round = max(n_teams // 2, 1)
+    n_rounds = -(-len(matches) // per_round)
+    n_gameweeks = n_rounds if n_gameweeks is None else n_gameweeks
+
+    strength = [rng.randint(1000, 1350) for _ in range(n_teams)]
+    ranking = sorted(range(n_teams), key=lambda t: strength[t])
+
+    # Difficulty 2 (weakest fifth of teams) to 5 (strongest)
+    def difficulty(team):
+        return 2 + min(ranking.index(team) * 4 // n_teams, 3)
+
+    teams = [{'id': t + 1,
+              'short_name': f'T{t + 1:02d}' if n_teams < 100 else f'T{t + 1:03d}',
+              'name': f'Team {t + 1}',
+              'strength_overall_home': strength[t] + 30,
+              'strength_overall_away': strength[t] - 30,
+              'strength_attack_home': strength[t] + rng.randint(-50, 50),
+              'strength_attack_away': strength[t] + rng.randint(-80, 20),
+              'strength_defence_home': strength[t] + rng.randint(-50, 50),
+              'strength_defence_away': strength[t] + rng.randint(-80, 20)} for t in range(n_teams)]
+
+    fixtures = []
+    for n, (home, away) in enumerate(matches):
+        event = n // per_round % n_gameweeks + 1
+        if rng.random() < blank_rate:
+            event = rng.randint(1, n_gameweeks) if rng.random() < double_rate else None
+        fixtures.append({'id': n + 1,
+                         'event': event,
+                         'team_h': home + 1,
+                         'team_a': away + 1,
+                         'team_h_difficulty': difficulty(away),
+                         'team_a_difficulty': difficulty(home)})
+
+    # Fixtures are listed by gameweek, unscheduled last, as in the API
+    fixtures.sort(key=lambda i: (i['event'] is None, i['event'] or 0, i['id']))
+
+    events = [{'id': g + 1, 'is_next': g == 0} for g in range(n_gameweeks)]
+    element_types = [{'id': n + 1, 'singular_name_short': name} for n, name in enumerate(POSITIONS)]
+    elements = [{'id': n + 1,
+                 'web_name': f'Player {n + 1}',
+                 'team': n % n_teams + 1,
+                 'element_type': n // n_teams % len(POSITIONS) + 1,
+                 'now_cost': rng.randint(40, 130)} for n in range(n_teams * players_per_team)]
+
+    data = {'events': events, 'teams': teams, 'elements': elements, 'element_types': element_types}
+
+    return data, fixtures
+
+
+# Write a season as the data files refresh_data.py saves, e.g. to point the snapshot directories at
+def write_season(directory, data, fixtures, date='20000101'):
+    for name, content in (('bootstrap_static', data), ('fixtures', fixtures)):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+        with open(os.path.join(directory, name, f'{name}_{date}.json'), 'w') as f:
+            json.dump(content, f)
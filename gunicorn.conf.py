@@ -0,0 +1,26 @@
+import gc
+import os
+
+# Load the app (and the season snapshot, prepared KPIs and warmed caches) once in the master process before the
+# workers are forked. Workers share those pages copy on write and the snapshot arrays through the memory mapped
+# file, so adding workers adds little memory.
+preload_app = True
+os.environ['FPL_PRELOAD'] = '1'
+
+bind = os.environ.get('FPL_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('FPL_WORKERS', 2))
+os.environ['FPL_SERVER_WORKERS'] = str(workers)
+threads = int(os.environ.get('FPL_THREADS', 4))
+wsgi_app = 'app:server'
+
+
+# Called in the master once the app is loaded, just before the first fork
+def when_ready(server):
+    from utility import parallel
+
+    # Scoring processes hold threads and pipes that must not be copied into the workers
+    parallel.shutdown()
+
+    # Objects loaded so far live for the whole run, keep the garbage collector from writing to (and so copying)
+    # their pages in every worker
+    gc.freeze()
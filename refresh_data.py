@@ -1,28 +1,16 @@
-import requests
-import json
-from datetime import datetime
+import argparse
 
-# Get current date to timestamp data
-date = datetime.today().strftime("%Y%m%d")
+from utility import refresh
 
-# Bootstrap-static
-# Load JSON
-url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
-data = requests.get(url)
-data = data.json()
+parser = argparse.ArgumentParser(description='Refresh the FPL data from the FPL API')
+parser.add_argument('--api-url', default=refresh.API_URL, help='Base URL of the FPL API')
+parser.add_argument('--loop', type=int, metavar='SECONDS',
+                    help='Keep running, refreshing the data every SECONDS seconds')
+args = parser.parse_args()
 
-# Write JSON
-path = f'data/bootstrap_static/bootstrap_static_{date}.json'
-with open(path, 'w') as f:
-    json.dump(data, f)
-
-# Fixtures
-# Load JSON
-url = 'https://fantasy.premierleague.com/api/fixtures/'
-data = requests.get(url)
-data = data.json()
-
-# Write JSON
-path = f'data/fixtures/fixtures_{date}.json'
-with open(path, 'w') as f:
-    json.dump(data, f)
+if args.loop:
+    refresh.run_forever(args.loop, args.api_url)
+else:
+    # Bootstrap-static and fixtures, only written if they changed
+    changed = refresh.refresh(args.api_url)
+    print(f'Changed: {", ".join(changed) or "nothing"}')
@@ -0,0 +1,19 @@
+import flask
+
+from utility import api, functions
+
+
+# Equivalent query strings get the same body and ETag, the parameters are echoed in canonical form
+def test_pairs_echoes_canonical_params(monkeypatch):
+    monkeypatch.setattr(functions, 'disk_cache', None)
+    app = flask.Flask(__name__)
+    app.register_blueprint(api.blueprint)
+    client = app.test_client()
+
+    first = client.get('/api/pairs?start=20&end=30&limit=3&skip_mgw=1&exclude=25')
+    second = client.get('/api/pairs?start=20&end=30&limit=3&skip_mgw=true&exclude=25,3,25')
+
+    assert first.status_code == second.status_code == 200
+    assert first.json['params']['exclude_gameweeks'] == ['25']
+    assert first.data == second.data
+    assert first.headers['ETag'] == second.headers['ETag']
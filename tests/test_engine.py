@@ -0,0 +1,70 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from utility import engine
+
+
+# Every group of group_size teams, lowest value first, ties ordered by teams
+def brute_force_groups(matrix, group_size, top_k, best_of):
+    groups = np.array(list(itertools.combinations(range(matrix.shape[0]), group_size)), dtype=np.intp)
+    values = engine.group_values(matrix, groups, best_of)
+    order = np.lexsort(tuple(groups.T[::-1]) + (values,))[:top_k]
+    return groups[order], values[order]
+
+
+# Every pair of items of different groups within budget, lowest value first, ties ordered by total cost then items
+def brute_force_item_pairs(group_values, item_group, item_cost, top_k, budget):
+    pairs = []
+    for i, j in itertools.combinations(range(len(item_group)), 2):
+        value = group_values[item_group[i], item_group[j]]
+        cost = item_cost[i] + item_cost[j]
+        if np.isfinite(value) and (budget is None or cost <= budget):
+            pairs.append((value, cost, i, j))
+    pairs.sort()
+    pairs = pairs[:top_k]
+
+    items = np.array([(i, j) for _, _, i, j in pairs], dtype=np.intp).reshape(-1, 2)
+    return items, np.array([i[0] for i in pairs]), np.array([i[1] for i in pairs])
+
+
+@pytest.mark.parametrize('seed', range(120))
+def test_top_groups_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n_teams = int(rng.integers(3, 12))
+    n_gameweeks = int(rng.integers(1, 10))
+    group_size = int(rng.integers(2, min(n_teams, 4) + 1))
+    best_of = int(rng.integers(1, group_size + 1))
+    top_k = int(rng.integers(1, 30))
+
+    # Few distinct values, so many groups tie
+    matrix = rng.integers(1, 6, (n_teams, n_gameweeks))
+
+    groups, values = engine.top_groups(matrix, group_size, top_k, best_of, block_size=int(rng.integers(1, 64)))
+    expected_groups, expected_values = brute_force_groups(matrix, group_size, top_k, best_of)
+
+    np.testing.assert_array_equal(groups, expected_groups)
+    np.testing.assert_array_equal(values, expected_values)
+
+
+@pytest.mark.parametrize('seed', range(120))
+def test_top_item_pairs_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n_groups = int(rng.integers(2, 8))
+    n_items = int(rng.integers(2, 25))
+    top_k = int(rng.integers(1, 40))
+
+    values = rng.integers(1, 5, n_groups * (n_groups - 1) // 2)
+    group_values = engine.pair_matrix(n_groups, values)
+    item_group = rng.integers(0, n_groups, n_items)
+    item_cost = rng.integers(40, 80, n_items)
+    budget = None if rng.random() < 0.3 else int(rng.integers(80, 160))
+
+    items, pair_values, cost = engine.top_item_pairs(group_values, item_group, item_cost, top_k, budget)
+    expected_items, expected_values, expected_cost = brute_force_item_pairs(group_values, item_group, item_cost,
+                                                                            top_k, budget)
+
+    np.testing.assert_array_equal(items, expected_items)
+    np.testing.assert_array_equal(pair_values, expected_values)
+    np.testing.assert_array_equal(cost, expected_cost)
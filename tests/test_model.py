@@ -0,0 +1,45 @@
+import numpy as np
+
+from utility import model
+
+
+def team(team_id, short_name):
+    return {'id': team_id, 'short_name': short_name, 'strength_overall_home': 1200, 'strength_overall_away': 1150,
+            'strength_attack_home': 1100, 'strength_attack_away': 1050, 'strength_defence_home': 1250,
+            'strength_defence_away': 1210}
+
+
+def fixture(fixture_id, event, team_h, team_a, team_h_difficulty=3, team_a_difficulty=3):
+    return {'id': fixture_id, 'event': event, 'team_h': team_h, 'team_a': team_a,
+            'team_h_difficulty': team_h_difficulty, 'team_a_difficulty': team_a_difficulty}
+
+
+# Four teams over two gameweeks, AAA plays at home twice in gameweek 1 while its opponents only play once there
+DATA = {'teams': [team(1, 'AAA'), team(2, 'BBB'), team(3, 'CCC'), team(4, 'DDD')],
+        'events': [{'id': 1, 'is_next': True}, {'id': 2, 'is_next': False}],
+        'elements': [],
+        'element_types': [{'id': 1, 'singular_name_short': 'GKP'}]}
+FIXTURES = [fixture(1, 1, 1, 2, team_h_difficulty=2),
+            fixture(2, 1, 1, 3, team_h_difficulty=4),
+            fixture(3, 2, 4, 1),
+            fixture(4, 2, 2, 3),
+            fixture(5, None, 4, 2)]
+
+
+def test_home_team_double_gameweek_when_away_teams_play_once():
+    arrays = model.build_season_arrays(DATA, FIXTURES)
+
+    np.testing.assert_array_equal(arrays['fixture_count'], [[2, 1], [1, 1], [1, 1], [0, 1]])
+    np.testing.assert_array_equal(arrays['opponent'][0, 0], [1, 2])
+    np.testing.assert_array_equal(arrays['home'][0, 0], [True, True])
+    np.testing.assert_array_equal(arrays['kpi_difficulty'][0, 0], [2, 4])
+    np.testing.assert_array_equal(arrays['mgw'], [True, False])
+    np.testing.assert_array_equal(arrays['bgw'], [True, False])
+
+    # Both fixtures are shown, the second as '01_2'
+    teams = ('AAA', 'BBB', 'CCC', 'DDD')
+    layout = model.display_layout(arrays['fixture_count'], arrays['opponent'].shape[-1])
+    assert model.fixture_name_dict(arrays['opponent'], layout, teams)['AAA'] == {'01': 'BBB', '01_2': 'CCC',
+                                                                                '02': 'DDD'}
+    assert model.fixture_value_dict(arrays['kpi_difficulty'], layout, teams, 4)['AAA'] == {'01': 2, '01_2': 4,
+                                                                                          '02': 3}
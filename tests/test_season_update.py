@@ -0,0 +1,85 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic
+from utility import engine, functions, model, snapshot
+
+
+def season_snapshot(data, fixtures, key):
+    arrays = model.build_season_arrays(data, fixtures)
+    for value in arrays.values():
+        value.setflags(write=False)
+    return snapshot.Snapshot(key, arrays, model.season_meta(data, fixtures))
+
+
+# Reschedule, postpone or change the difficulty of a few fixtures
+def change_fixtures(fixtures, n_gameweeks, n_changes, rng):
+    fixtures = copy.deepcopy(fixtures)
+    for fixture in rng.sample([i for i in fixtures if i['event']], n_changes):
+        kind = rng.random()
+        if kind < 0.5:
+            fixture['event'] = rng.randint(1, n_gameweeks)
+        elif kind < 0.8:
+            fixture[rng.choice(('team_h_difficulty', 'team_a_difficulty'))] = rng.randint(2, 5)
+        else:
+            fixture['event'] = None
+    return fixtures
+
+
+def assert_same_range_index(updated, built, n_gameweeks, rng):
+    windows = [(start, end) for start in range(1, n_gameweeks + 1) for end in range(start, n_gameweeks + 1)]
+    for start, end in rng.sample(windows, min(len(windows), 40)):
+        exclude = rng.sample(range(start, end + 1), rng.randint(0, min(end - start + 1, 3)))
+        np.testing.assert_array_equal(engine.query_range_index(updated, start, end, exclude),
+                                      engine.query_range_index(built, start, end, exclude))
+
+
+def assert_same_season(updated, built, n_gameweeks, rng):
+    for name in ('layout', 'opponent_index', 'fix_name', 'bgw', 'mgw', 'teams', 'team_max', 'weighted'):
+        if isinstance(built[name], np.ndarray):
+            np.testing.assert_array_equal(updated[name], built[name])
+        elif name == 'layout':
+            assert [keys for keys, _ in updated[name]] == [keys for keys, _ in built[name]]
+            for (_, positions), (_, expected) in zip(updated[name], built[name]):
+                np.testing.assert_array_equal(positions, expected)
+        else:
+            assert updated[name] == built[name]
+
+    for kpi in model.KPIS:
+        prepared, expected = updated['kpis'][kpi], built['kpis'][kpi]
+        for name in ('fix_val', 'fix_name', 'mgw', 'bgw', 'max_val'):
+            assert prepared[name] == expected[name]
+        assert prepared['matrix'].equals(expected['matrix'])
+        assert_same_range_index(prepared['range_index'], expected['range_index'], n_gameweeks, rng)
+
+
+# A chain of snapshots, each updated from the one before, equals each snapshot built in full
+# Few changes in a large league keep the range index patched, many changes rebuild it
+@pytest.mark.parametrize('seed', range(20))
+def test_update_season_matches_build_season(seed):
+    rng = random.Random(seed)
+    n_teams = rng.choice((6, 12, 20, 40))
+    data, fixtures = synthetic.generate_season(n_teams, seed=seed)
+    season = season_snapshot(data, fixtures, (seed, 0))
+    n_gameweeks = season.meta['n_gameweeks']
+
+    prepared = functions.build_season(season)
+    for step in range(1, 5):
+        fixtures = change_fixtures(fixtures, n_gameweeks, rng.randint(1, 4), rng)
+        season = season_snapshot(data, fixtures, (seed, step))
+
+        built = functions.build_season(season)
+        updated = functions.update_season(prepared, season)
+        if updated is None:
+            # Only when the most fixtures in a gameweek or a blank gameweek value changed
+            shape_changed = season.arrays['opponent'].shape != prepared['arrays']['opponent'].shape
+            max_changed = not np.array_equal(built['team_max'].max(axis=-1), prepared['team_max'].max(axis=-1))
+            assert shape_changed or max_changed
+            updated = built
+        else:
+            assert_same_season(updated, built, n_gameweeks, rng)
+
+        prepared = updated
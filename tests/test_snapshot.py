@@ -0,0 +1,12 @@
+from utility import snapshot
+
+
+# Only the binary snapshot given is kept, other files in the directory are left alone
+def test_remove_old_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path))
+    for name in ('season_20210209.snap', 'season_20210221.snap', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+
+    snapshot.remove_old_snapshots(str(tmp_path / 'season_20210221.snap'))
+
+    assert sorted(i.name for i in tmp_path.iterdir()) == ['notes.txt', 'season_20210221.snap']
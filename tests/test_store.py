@@ -0,0 +1,41 @@
+import json
+
+import pandas as pd
+
+from utility import store
+
+
+# Values stored by another version are never read and are purged with the older snapshots
+def test_disk_cache_version(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    old, new = store.DiskCache(path, 10 ** 7, version=1), store.DiskCache(path, 10 ** 7, version=2)
+
+    old.put(('snapshot', 'pairs'), 'old')
+    assert new.get(('snapshot', 'pairs')) is None
+
+    new.put(('snapshot', 'pairs'), 'new')
+    new.purge('snapshot')
+    assert old.get(('snapshot', 'pairs')) is None
+    assert new.get(('snapshot', 'pairs')) == 'new'
+
+
+# A store that cannot be opened stores and finds nothing, the parts go to the browser as JSON instead
+def test_result_store_failure(tmp_path):
+    result_store = store.ResultStore(str(tmp_path))
+    parts = {'fixtures_pair': pd.DataFrame({'TEAM_1': ['ARS', 'CHE'], 'TEAM_2': ['LIV', 'MCI'], 'VALUE': [5, 7]},
+                                           index=[13, 2]),
+             'all_fixture_vals/ARS': pd.Series([2, 3, 5], index=[1, 2, 3], name='ARS')}
+
+    assert not result_store.put('key', parts)
+    assert result_store.get('key', parts) is None
+
+    loaded = store.parts_from_json(json.loads(json.dumps(store.parts_to_json(parts))), parts)
+    pd.testing.assert_frame_equal(loaded['fixtures_pair'], parts['fixtures_pair'])
+    pd.testing.assert_series_equal(loaded['all_fixture_vals/ARS'], parts['all_fixture_vals/ARS'])
+
+
+def test_result_store_parts(tmp_path):
+    result_store = store.ResultStore(str(tmp_path / 'store.sqlite'))
+    assert result_store.put('key', {'a': 1, 'b': [2]})
+    assert result_store.get('key', ['b']) == {'b': [2]}
+    assert result_store.get('key', ['a', 'c']) is None
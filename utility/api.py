@@ -0,0 +1,175 @@
+import hashlib
+import json
+import math
+
+from flask import Blueprint, Response, request
+
+from utility import functions, model, snapshot
+
+blueprint = Blueprint('api', __name__, url_prefix='/api')
+
+KPI_CHOICES = model.KPIS + ('custom_kpi',)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _flag(name):
+    return request.args.get(name, '0').lower() in ('1', 'true', 'yes')
+
+
+def _int(name, default):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f'{name} must be an integer, got {value!r}')
+
+
+def _team(name, teams):
+    value = request.args.get(name)
+    if value not in teams:
+        raise BadRequest(f'{name} must be one of {", ".join(teams)}, got {value!r}')
+    return value
+
+
+# complimenting_fixtures_calc parameters from the query string, in canonical form (they are echoed in the responses,
+# which are the same for the same canonical parameters)
+# kpi, start, end, exclude (comma separated gameweeks), skip_mgw, skip_bgw and for the custom KPI
+# custom_kpi as a JSON object of team short name to value (teams left out are 0)
+def calc_params(season):
+    teams = season.meta['teams']
+    n_gameweeks = season.meta['n_gameweeks']
+
+    kpi = request.args.get('kpi', 'difficulty')
+    if kpi not in KPI_CHOICES:
+        raise BadRequest(f'kpi must be one of {", ".join(KPI_CHOICES)}, got {kpi!r}')
+
+    custom_kpi = {}
+    if kpi == 'custom_kpi':
+        try:
+            values = json.loads(request.args.get('custom_kpi', '{}'))
+        except ValueError:
+            raise BadRequest('custom_kpi must be a JSON object of team short name to value')
+        if not isinstance(values, dict) or set(values) - set(teams) or \
+                not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+                        for v in values.values()):
+            raise BadRequest('custom_kpi must be a JSON object of team short name to value')
+        custom_kpi = {team: values.get(team, 0) for team in teams}
+
+    start_gameweek = _int('start', season.meta['next_gameweek'] or 1)
+    end_gameweek = _int('end', n_gameweeks)
+    if not 1 <= start_gameweek <= end_gameweek <= n_gameweeks:
+        raise BadRequest(f'start and end must be gameweeks with 1 <= start <= end <= {n_gameweeks}')
+
+    try:
+        exclude = [str(int(i)) for i in request.args.get('exclude', '').split(',') if i.strip()]
+    except ValueError:
+        raise BadRequest('exclude must be comma separated gameweeks')
+
+    params = {'kpi': kpi,
+              'custom_kpi': custom_kpi,
+              'start_gameweek': start_gameweek,
+              'end_gameweek': end_gameweek,
+              'exclude_gameweeks': exclude,
+              'skip_multi_gameweeks': _flag('skip_mgw'),
+              'skip_blank_gameweeks': _flag('skip_bgw')}
+
+    # Excluded gameweeks sorted, without duplicates and only those inside the window
+    params['exclude_gameweeks'] = [str(i) for i in functions.canonical_params(**params)[4]]
+    return params
+
+
+# Strong ETag, the same response for the same snapshot and canonical parameters
+def etag(season, endpoint, params, extra=()):
+    key = (season.id, endpoint, functions.canonical_params(**params), tuple(extra))
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:32]
+
+
+def _json(content, status=200, tag=None):
+    response = Response(json.dumps(content), status=status, content_type='application/json')
+    if tag is not None:
+        response.set_etag(tag)
+        # Clients may keep responses but must check they are still current
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _not_modified(tag):
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
+        response.set_etag(tag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+
+@blueprint.errorhandler(BadRequest)
+def bad_request(error):
+    return _json({'error': str(error)}, status=400)
+
+
+# Ranked team pairs, lowest value first
+# Optional team (only pairs with this team) and limit (number of pairs)
+@blueprint.route('/pairs')
+def pairs():
+    season = snapshot.get_snapshot()
+    params = calc_params(season)
+    team = request.args.get('team') or None
+    if team is not None:
+        _team('team', season.meta['teams'])
+    limit = _int('limit', None)
+    if limit is not None and limit < 0:
+        raise BadRequest(f'limit must not be negative, got {limit}')
+
+    tag = etag(season, 'pairs', params, (team, limit))
+    response = _not_modified(tag)
+    if response is not None:
+        return response
+
+    fixture_pair, _, _, mgw, bgw, _, _ = functions.complimenting_fixtures_calc(**params)
+    if team is not None:
+        fixture_pair = fixture_pair[(fixture_pair['TEAM_1'] == team) | (fixture_pair['TEAM_2'] == team)]
+    if limit is not None:
+        fixture_pair = fixture_pair.head(limit)
+
+    return _json({'snapshot': season.id,
+                  'params': params,
+                  'multi_gameweeks': mgw,
+                  'blank_gameweeks': bgw,
+                  'pairs': [{'team_1': team_1, 'team_2': team_2, 'value': value} for team_1, team_2, value in
+                            zip(fixture_pair['TEAM_1'], fixture_pair['TEAM_2'], fixture_pair['VALUE'].tolist())]},
+                 tag=tag)
+
+
+# Two teams' opponents and values per gameweek of the window, and the best opponent each gameweek
+# Gameweeks with more than one fixture appear once per fixture, blank gameweeks have opponent '-'
+@blueprint.route('/compare')
+def compare():
+    season = snapshot.get_snapshot()
+    params = calc_params(season)
+    team1 = _team('team1', season.meta['teams'])
+    team2 = _team('team2', season.meta['teams'])
+    if team1 == team2:
+        raise BadRequest('team1 and team2 must be different teams')
+
+    tag = etag(season, 'compare', params, (team1, team2))
+    response = _not_modified(tag)
+    if response is not None:
+        return response
+
+    fix_name, fix_val, mgw, bgw = functions.compare_teams(**params, team1=team1, team2=team2)
+    fix_name = fix_name.replace('BGW', '-')
+
+    return _json({'snapshot': season.id,
+                  'params': params,
+                  'multi_gameweeks': mgw,
+                  'blank_gameweeks': bgw,
+                  'gameweeks': [int(i) for i in fix_name.columns],
+                  'opponents': {team: fix_name.loc[team].tolist() for team in (team1, team2)},
+                  'best_opponent': fix_name.loc['BEST_OPPONENT'].tolist(),
+                  'values': {team: fix_val.loc[team].tolist() for team in (team1, team2)}},
+                 tag=tag)
@@ -0,0 +1,182 @@
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from utility import functions, snapshot
+
+COLUMNS = ['kpi', 'start_gameweek', 'end_gameweek', 'skip_multi_gameweeks', 'skip_blank_gameweeks',
+           'rank', 'team_1', 'team_2', 'value']
+
+# Combinations per task sent to a worker process
+CHUNK_SIZE = 64
+
+# Custom KPI values of the batch, set in each worker before it starts
+_custom_kpi = {}
+
+# Prepared fixtures of the batch by snapshot and KPI, prepare_fixtures only keeps those of the built-in KPIs
+_prepared = {}
+
+
+# Parse '1-5,8,10-12' into [1, 2, 3, 4, 5, 8, 10, 11, 12]
+def parse_range(value):
+    numbers = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            numbers += range(int(first), int(last) + 1)
+        else:
+            numbers.append(int(part))
+    return sorted(set(numbers))
+
+
+# Every combination of the grid as complimenting_fixtures_calc parameters (without custom_kpi)
+# Windows that would end after the last gameweek are left out
+def parameter_grid(kpis, starts, lengths, skip_multi_gameweeks, skip_blank_gameweeks, n_gameweeks):
+    grid = []
+    for kpi, start, length, skip_mgw, skip_bgw in itertools.product(kpis, starts, lengths, skip_multi_gameweeks,
+                                                                    skip_blank_gameweeks):
+        end = start + length - 1
+        if 1 <= start and end <= n_gameweeks:
+            grid.append((kpi, start, end, skip_mgw, skip_bgw))
+    return grid
+
+
+def _init_worker(custom_kpi):
+    global _custom_kpi
+    _custom_kpi = custom_kpi
+
+
+def _prepare_fixtures(season, kpi):
+    key = (season.id, kpi)
+    if key not in _prepared:
+        _prepared[key] = functions.prepare_fixtures(season, kpi, _custom_kpi)
+    return _prepared[key]
+
+
+# Ranked pairs of each combination, top (pairs per combination) None for all of them
+def rank_combinations(combinations, top=None):
+    season = snapshot.get_snapshot()
+    frames = []
+    for kpi, start, end, skip_mgw, skip_bgw in combinations:
+        prepared = _prepare_fixtures(season, kpi)
+        fixture_pair, _ = functions.fixture_calc_indexed(prepared, start, end, [], skip_mgw, skip_bgw)
+        if top is not None:
+            fixture_pair = fixture_pair.head(top)
+
+        frames.append(pd.DataFrame({'kpi': kpi,
+                                    'start_gameweek': start,
+                                    'end_gameweek': end,
+                                    'skip_multi_gameweeks': skip_mgw,
+                                    'skip_blank_gameweeks': skip_bgw,
+                                    'rank': range(1, len(fixture_pair) + 1),
+                                    'team_1': fixture_pair['TEAM_1'].to_numpy(),
+                                    'team_2': fixture_pair['TEAM_2'].to_numpy(),
+                                    'value': fixture_pair['VALUE'].to_numpy()}))
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+
+
+# Writes result chunks to a CSV file as they arrive
+class CSVWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        csv.writer(self.file).writerow(COLUMNS)
+
+    def write(self, frame):
+        frame.to_csv(self.file, header=False, index=False)
+
+    def close(self):
+        self.file.close()
+
+
+# Writes result chunks to a Parquet file as they arrive, needs pyarrow
+class ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Writing Parquet needs pyarrow (pip install pyarrow), or write a .csv file instead')
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.writer = None
+
+    def write(self, frame):
+        table = self.pyarrow.Table.from_pandas(frame, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_writer(path):
+    if path.endswith('.parquet'):
+        return ParquetWriter(path)
+    return CSVWriter(path)
+
+
+# Rank every combination and stream the rows to output, returns the number of combinations
+# The snapshot and prepared KPIs are loaded once, forked worker processes share them
+def run(grid, output, custom_kpi=None, top=None, workers=None, progress=sys.stderr):
+    global _custom_kpi
+
+    workers = workers or os.cpu_count() or 1
+    _custom_kpi = custom_kpi or {}
+    _prepared.clear()
+    season = snapshot.get_snapshot()
+    for kpi in sorted(set(combination[0] for combination in grid)):
+        _prepare_fixtures(season, kpi)
+
+    chunks = [grid[i:i + CHUNK_SIZE] for i in range(0, len(grid), CHUNK_SIZE)]
+    writer = open_writer(output)
+    started = time.perf_counter()
+    done = 0
+
+    def report():
+        if progress is not None:
+            elapsed = time.perf_counter() - started
+            rate = done / elapsed if elapsed > 0 else 0
+            print(f'\r{done}/{len(grid)} combinations ({rate:.0f}/s)', end='', file=progress, flush=True)
+
+    try:
+        if workers == 1 or len(chunks) <= 1:
+            results = (rank_combinations(chunk, top) for chunk in chunks)
+            executor = None
+        else:
+            # Forked workers start with the parent's snapshot and prepared KPIs
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                           initargs=(_custom_kpi,))
+            results = executor.map(rank_combinations, chunks, itertools.repeat(top))
+
+        try:
+            # Results come back in grid order
+            for chunk, frame in zip(chunks, results):
+                writer.write(frame)
+                done += len(chunk)
+                report()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+    finally:
+        writer.close()
+
+    if progress is not None:
+        print(f'\n{len(grid)} combinations written to {output} in {time.perf_counter() - started:.1f}s',
+              file=progress)
+
+    return len(grid)
@@ -0,0 +1,158 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+_missing = object()
+
+
+# Approximate memory held by a cached value
+def estimate_size(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum()) if isinstance(value, pd.DataFrame) \
+            else int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+# A value being computed, shared with the callers waiting for it
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+# Thread safe least recently used cache, bounded by number of entries and/or total size in bytes
+class LRUCache:
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+        self._entries = OrderedDict()
+        self._calls = {}
+        self._sizes = {}
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Value for key, computed by function on a miss
+    # Callers (threads) missing the same key while it is computed wait for that computation instead of starting
+    # their own, and get its value or exception
+    def get_or_compute(self, key, function):
+        with self._lock:
+            value = self._entries.get(key, _missing)
+            if value is not _missing:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                waiting = True
+            else:
+                call = self._calls[key] = _Call()
+                self.misses += 1
+                waiting = False
+
+        if waiting:
+            return call.result()
+
+        try:
+            call.value = function()
+            self.put(key, call.value)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            # Stored before it stops being in flight, so later callers find it in the cache
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.value
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+
+        # Never keep a value bigger than the whole cache
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._bytes += size
+
+            while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries) or
+                                     (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                old_key, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    # Drop everything when the data the entries were computed from changes (e.g. a new snapshot ID)
+    def validate(self, generation):
+        if generation == self._generation:
+            return
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._sizes.clear()
+                self._bytes = 0
+                self._generation = generation
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    # Sizes are only worked out for a cache bounded by bytes, bytes is None for other caches
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'coalesced': self.coalesced,
+                    'inflight': len(self._calls),
+                    'entries': len(self._entries),
+                    'bytes': self._bytes if self.max_bytes is not None else None}
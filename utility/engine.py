@@ -0,0 +1,362 @@
+import heapq
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# Team index pairs (i < j) for the upper triangle of a teams x teams matrix, in row-major order
+@lru_cache(maxsize=None)
+def pair_indices(n_teams):
+    team_1, team_2 = np.triu_indices(n_teams, 1)
+    team_1.setflags(write=False)
+    team_2.setflags(write=False)
+    return team_1, team_2
+
+
+# Score every unordered pair of teams at once
+# matrix is teams x gameweeks, value for a pair is the sum over gameweeks of the lower of the two teams
+# A stack of matrices (e.g. KPI x teams x gameweeks) is scored in one go, giving KPI x pairs
+def pair_values(matrix):
+    matrix = np.ascontiguousarray(matrix)
+    team_1, team_2 = pair_indices(matrix.shape[-2])
+    return np.minimum(matrix[..., team_1, :], matrix[..., team_2, :]).sum(axis=-1)
+
+
+# Row label each pair had in the ordered pair table (every team against every team, self pairs removed)
+def pair_labels(n_teams):
+    team_1, team_2 = pair_indices(n_teams)
+    return team_1 * (n_teams - 1) + team_2 - 1
+
+
+# Build the ranked TEAM_1/TEAM_2/VALUE frame from the pair values
+def pair_frame(teams, values):
+    teams = np.asarray(teams, dtype=object)
+    team_1, team_2 = pair_indices(len(teams))
+
+    fixture_pair = pd.DataFrame({'TEAM_1': teams[team_1],
+                                 'TEAM_2': teams[team_2],
+                                 'VALUE': values},
+                                index=pair_labels(len(teams)))
+    fixture_pair = fixture_pair.sort_values('VALUE')
+
+    return fixture_pair
+
+
+# Prefix sums over gameweeks of each pair's per-gameweek min, so any gameweek window is one subtraction per pair
+# matrix is teams x gameweeks with consecutive gameweeks starting at first_gameweek
+# A stack of matrices (e.g. KPI x teams x gameweeks) is indexed in one go, select_index picks one of them
+def build_range_index(matrix, first_gameweek=1):
+    matrix = np.ascontiguousarray(matrix)
+    team_1, team_2 = pair_indices(matrix.shape[-2])
+
+    # gameweeks x pairs
+    pair_mins = np.ascontiguousarray(np.minimum(matrix[..., team_1, :], matrix[..., team_2, :]).swapaxes(-1, -2))
+
+    # Row g holds the total of the first g gameweeks
+    shape = pair_mins.shape[:-2] + (pair_mins.shape[-2] + 1, pair_mins.shape[-1])
+    cumulative = np.zeros(shape, dtype=pair_mins.dtype)
+    np.cumsum(pair_mins, axis=-2, out=cumulative[..., 1:, :])
+
+    return {'first_gameweek': first_gameweek, 'pair_mins': pair_mins, 'cumulative': cumulative}
+
+
+# A range index updated with update_range_index shares its arrays with the index it was updated from and keeps the
+# columns of the changed pairs in a patch, until the patch holds more than this fraction of the pairs
+PATCH_FRACTION = 0.25
+
+
+# Range index of a changed matrix, only the pairs with a team in rows are recomputed (from first_gameweek_changed on)
+# The other pairs are shared with range_index, which was built from the matrix before the change, and only the
+# columns of the changed pairs are copied. order optionally gives the row of matrix of each team of the index.
+def update_range_index(range_index, matrix, rows, first_gameweek_changed, order=None):
+    n_teams = matrix.shape[-2]
+    order = np.arange(n_teams) if order is None else np.asarray(order)
+    team_1, team_2 = pair_indices(n_teams)
+
+    changed = np.zeros(n_teams, dtype=bool)
+    changed[list(rows)] = True
+    pairs = np.flatnonzero(changed[team_1] | changed[team_2])
+    start = max(first_gameweek_changed - range_index['first_gameweek'], 0)
+    if len(pairs) == 0 or start >= matrix.shape[-1]:
+        return range_index
+
+    patch = range_index.get('patch')
+    patched = pairs if patch is None else np.union1d(patch['pairs'], pairs)
+    if len(patched) > PATCH_FRACTION * len(team_1):
+        # Most pairs changed since the index was built, build it again rather than patch it
+        return build_range_index(matrix[..., order, :], range_index['first_gameweek'])
+
+    pair_mins = _pair_columns(range_index, 'pair_mins', patched)
+    cumulative = _pair_columns(range_index, 'cumulative', patched)
+
+    # changed gameweeks x changed pairs
+    columns = np.searchsorted(patched, pairs)
+    mins = np.minimum(matrix[..., order[team_1[pairs]], start:], matrix[..., order[team_2[pairs]], start:])
+    mins = mins.swapaxes(-1, -2)
+    pair_mins[..., start:, columns] = mins
+    cumulative[..., start + 1:, columns] = cumulative[..., start:start + 1, columns] + np.cumsum(mins, axis=-2)
+
+    return {'first_gameweek': range_index['first_gameweek'],
+            'pair_mins': range_index['pair_mins'],
+            'cumulative': range_index['cumulative'],
+            'patch': {'pairs': patched, 'pair_mins': pair_mins, 'cumulative': cumulative}}
+
+
+# Copy of some pair columns of a range index (pairs sorted), patched columns included
+def _pair_columns(range_index, name, pairs):
+    columns = range_index[name][..., pairs]
+    patch = range_index.get('patch')
+    if patch is not None:
+        columns[..., np.searchsorted(pairs, patch['pairs'])] = patch[name]
+    return columns
+
+
+# One matrix of a stacked range index
+def select_index(range_index, i):
+    selected = {'first_gameweek': range_index['first_gameweek'],
+                'pair_mins': range_index['pair_mins'][i],
+                'cumulative': range_index['cumulative'][i]}
+    patch = range_index.get('patch')
+    if patch is not None:
+        selected['patch'] = {'pairs': patch['pairs'], 'pair_mins': patch['pair_mins'][i],
+                             'cumulative': patch['cumulative'][i]}
+    return selected
+
+
+# Pair values for gameweeks start_gameweek to end_gameweek, less any excluded gameweeks in that window
+def query_range_index(range_index, start_gameweek, end_gameweek, exclude_gameweeks=()):
+    first = range_index['first_gameweek']
+    pair_mins = range_index['pair_mins']
+
+    start = max(start_gameweek - first, 0)
+    end = min(end_gameweek - first + 1, pair_mins.shape[-2])
+    if end <= start:
+        return np.zeros(pair_mins.shape[:-2] + pair_mins.shape[-1:], dtype=pair_mins.dtype)
+
+    # Excluded gameweeks (blank, multi or user specified) inside the window
+    excluded = sorted(set(gw - first for gw in exclude_gameweeks if start <= gw - first < end))
+
+    values = _window_values(pair_mins, range_index['cumulative'], start, end, excluded)
+    patch = range_index.get('patch')
+    if patch is not None:
+        values[..., patch['pairs']] = _window_values(patch['pair_mins'], patch['cumulative'], start, end, excluded)
+
+    return values
+
+
+def _window_values(pair_mins, cumulative, start, end, excluded):
+    values = cumulative[..., end, :] - cumulative[..., start, :]
+    if excluded:
+        values = values - pair_mins[..., excluded, :].sum(axis=-2)
+    return values
+
+
+# Value of groups of teams rotated between: per gameweek the sum of the best_of lowest values in the group
+# matrix is teams x gameweeks, groups is groups x group size team indices
+# With best_of=1 this is the per-gameweek minimum, the same as pair_values for groups of two
+def group_values(matrix, groups, best_of=1):
+    values = np.asarray(matrix)[np.asarray(groups)]
+    if best_of == 1:
+        return values.min(axis=-2).sum(axis=-1)
+    return np.sort(values, axis=-2)[..., :best_of, :].sum(axis=(-2, -1))
+
+
+# Lowest best_of values per gameweek of each set of teams from j onwards, padded with inf (teams + 1 x best_of x gws)
+def _suffix_best(values, best_of):
+    n_teams, n_gameweeks = values.shape
+    suffix = np.full((n_teams + 1, best_of, n_gameweeks), np.inf)
+    for j in range(n_teams - 1, -1, -1):
+        suffix[j] = np.sort(np.concatenate([suffix[j + 1], values[j][None]]), axis=0)[:best_of]
+    return suffix
+
+
+# Merge one more team's values into the lowest best_of values per gameweek of partial groups
+def _merge_best(state, team_values):
+    if state.shape[-2] == 1:
+        return np.minimum(state, team_values[..., None, :])
+    return np.sort(np.concatenate([state, team_values[..., None, :]], axis=-2), axis=-2)[..., :-1, :]
+
+
+# Lowest possible value of any group completing partial groups from their suffix of remaining teams
+def _lower_bound(state, suffix):
+    best_of = state.shape[-2]
+    if best_of == 1:
+        return np.minimum(state, suffix).sum(axis=(-2, -1))
+    return np.sort(np.concatenate([state, suffix], axis=-2), axis=-2)[..., :best_of, :].sum(axis=(-2, -1))
+
+
+# Top (lowest value) top_k groups of group_size teams, see group_values
+# Groups are searched depth first in blocks, teams in increasing index order. A partial group is dropped once
+# the lowest value it could still reach is worse than the current top_k-th group, which a greedy pass seeds.
+# Returns groups (top_k x group_size, ascending team indices) and values, ordered by value then teams
+# first_teams limits the search to groups whose lowest team index is one of them, to split the search into parts
+def top_groups(matrix, group_size, top_k, best_of=1, block_size=16384, first_teams=None):
+    matrix = np.asarray(matrix)
+    n_teams = matrix.shape[0]
+    if not 1 <= group_size <= n_teams:
+        raise ValueError(f'group_size must be between 1 and the number of teams ({n_teams}), got {group_size}')
+    if not 1 <= best_of <= group_size:
+        raise ValueError(f'best_of must be between 1 and group_size ({group_size}), got {best_of}')
+
+    values = matrix.astype(np.float64)
+    suffix = _suffix_best(values, best_of)
+
+    first = np.arange(n_teams - group_size + 1)
+    if first_teams is not None:
+        first = np.intersect1d(first, first_teams)
+
+    # Max heap of the best groups so far, entries ordered so the worst (highest value, then teams) is on top
+    heap = []
+    seen = set()
+
+    def threshold():
+        return -heap[0][0] if len(heap) == top_k else np.inf
+
+    def offer(groups, scores):
+        keep = scores <= threshold()
+        groups, scores = groups[keep], scores[keep]
+        if len(scores) > top_k:
+            best = np.lexsort(tuple(groups.T[::-1]) + (scores,))[:top_k]
+            groups, scores = groups[best], scores[best]
+        for group, score in zip(groups.tolist(), scores.tolist()):
+            group = tuple(group)
+            if group in seen:
+                continue
+            entry = (-score, tuple(-t for t in group))
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+                seen.add(group)
+            elif entry > heap[0]:
+                seen.discard(tuple(-t for t in heapq.heappushpop(heap, entry)[1]))
+                seen.add(group)
+
+    # Greedy groups from the best individual teams give a good threshold before the search starts
+    if top_k > 0:
+        for team in np.argsort(values.sum(axis=1), kind='stable')[:max(top_k, 8)].tolist():
+            group = [team]
+            while len(group) < group_size:
+                candidates = np.setdiff1d(np.arange(n_teams), group)
+                extended = np.column_stack([np.tile(group, (len(candidates), 1)), candidates])
+                group.append(int(candidates[np.argmin(group_values(values, extended, best_of))]))
+            group.sort()
+            if group[0] not in first:
+                continue
+            groups = np.array([group])
+            offer(groups, group_values(values, groups, best_of))
+
+    def search(groups, state):
+        depth = groups.shape[1]
+        last = groups[:, -1]
+
+        # Each partial group takes the next team from after its last team, leaving enough teams to complete it
+        counts = np.maximum(n_teams - (group_size - depth) - last, 0)
+        limit = max(block_size // max(int(counts.max(initial=1)), 1), 1)
+        for start in range(0, len(groups), limit):
+            block = slice(start, start + limit)
+            block_counts = counts[block]
+            parent = np.repeat(np.arange(len(block_counts)), block_counts)
+            if len(parent) == 0:
+                continue
+            offsets = np.arange(len(parent)) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+            team = last[block][parent] + 1 + offsets
+
+            child_groups = np.column_stack([groups[block][parent], team])
+            child_state = _merge_best(state[block][parent], values[team])
+
+            if depth + 1 == group_size:
+                offer(child_groups, child_state.sum(axis=(-2, -1)))
+                continue
+
+            bound = _lower_bound(child_state, suffix[team + 1])
+            keep = bound <= threshold()
+            order = np.argsort(bound[keep], kind='stable')
+            search(child_groups[keep][order], child_state[keep][order])
+
+    if top_k > 0:
+        state = np.concatenate([values[first][:, None], np.full((len(first), best_of - 1, values.shape[1]), np.inf)],
+                               axis=1)
+        if group_size == 1:
+            offer(first[:, None], values[first].sum(axis=1))
+        else:
+            bound = _lower_bound(state, suffix[first + 1])
+            keep = bound <= threshold()
+            order = np.argsort(bound[keep], kind='stable')
+            search(first[keep][order][:, None], state[keep][order])
+
+    entries = sorted((-score, tuple(-t for t in group)) for score, group in heap)
+    groups = np.array([group for _, group in entries], dtype=np.intp).reshape(-1, group_size)
+
+    return groups, group_values(matrix, groups, best_of)
+
+
+# Build the ranked TEAM_1 ... TEAM_k / VALUE frame from top_groups
+def group_frame(teams, groups, values):
+    teams = np.asarray(teams, dtype=object)
+    columns = {f'TEAM_{i + 1}': teams[groups[:, i]] for i in range(groups.shape[1])}
+    columns['VALUE'] = values
+    return pd.DataFrame(columns)
+
+
+# Square groups x groups matrix of the pair values, inf on the diagonal (a group is not paired with itself)
+def pair_matrix(n_teams, values):
+    team_1, team_2 = pair_indices(n_teams)
+    matrix = np.full((n_teams, n_teams), np.inf)
+    matrix[team_1, team_2] = values
+    matrix[team_2, team_1] = values
+    return matrix
+
+
+# Top (lowest value) top_k pairs of items (e.g. players), each item belonging to a group (e.g. its team)
+# A pair of items has the value of the pair of their groups, so groups pairs are visited in value order and only
+# the item pairs within budget are generated, from items sorted by cost. Pairs with the same value are ordered by
+# total cost, then items. Returns item pairs (top_k x 2, lower index first), values and total costs
+def top_item_pairs(group_values, item_group, item_cost, top_k, budget=None):
+    item_group = np.asarray(item_group, dtype=np.intp)
+    item_cost = np.asarray(item_cost)
+    n_groups = group_values.shape[0]
+    budget = np.inf if budget is None else budget
+
+    # Items of each group, cheapest first
+    order = np.lexsort((np.arange(len(item_group)), item_cost, item_group))
+    group_start = np.searchsorted(item_group[order], np.arange(n_groups + 1))
+    cheapest = np.full(n_groups, np.inf)
+    has_items = group_start[1:] > group_start[:-1]
+    cheapest[has_items] = item_cost[order[group_start[:-1][has_items]]]
+
+    # Group pairs that have an affordable pair of items, best value first
+    group_1, group_2 = pair_indices(n_groups)
+    values = group_values[group_1, group_2]
+    feasible = np.isfinite(values) & (cheapest[group_1] + cheapest[group_2] <= budget)
+    group_1, group_2, values = group_1[feasible], group_2[feasible], values[feasible]
+    ranked = np.argsort(values, kind='stable')
+    group_1, group_2, values = group_1[ranked], group_2[ranked], values[ranked]
+
+    found = []
+    n_found = 0
+    start = 0
+    while start < len(values) and n_found < top_k:
+        # All group pairs with this value, so ties are ordered by cost across them
+        end = int(np.searchsorted(values, values[start], side='right'))
+        items_1, items_2 = [], []
+        for a, b in zip(group_1[start:end].tolist(), group_2[start:end].tolist()):
+            items_a = order[group_start[a]:group_start[a + 1]]
+            items_b = order[group_start[b]:group_start[b + 1]]
+
+            # For each item of a, the items of b it can be paired with are a prefix of b's sorted items
+            counts = np.searchsorted(item_cost[items_b], budget - item_cost[items_a], side='right')
+            items_1.append(np.repeat(items_a, counts))
+            items_2.append(items_b[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)])
+
+        items = np.sort(np.column_stack([np.concatenate(items_1), np.concatenate(items_2)]), axis=1)
+        cost = item_cost[items].sum(axis=1)
+        best = np.lexsort((items[:, 1], items[:, 0], cost))[:top_k - n_found]
+        found.append((items[best], np.full(len(best), values[start]), cost[best]))
+        n_found += len(best)
+        start = end
+
+    if not found:
+        return np.empty((0, 2), dtype=np.intp), np.empty(0), np.empty(0, dtype=item_cost.dtype)
+
+    items, values, cost = (np.concatenate(i) for i in zip(*found))
+    return items, values, cost
@@ -1,275 +1,79 @@
-import copy
 import os
-import json
 import pandas as pd
 import numpy as np
-
-
-# Load in data
-def load_data():
-    # Bootstrap Static Data
-    # List files in data directory
-    file_list = os.listdir("data//bootstrap_static")
-
-    # Sort and select first (latest) data set
-    file_list.sort(reverse=True)
-    file_list = file_list[0]
-
-    # Import data
-    path = f'data/bootstrap_static/{file_list}'
-    with open(path) as f:
-        data = json.load(f)
-
-    # Fixtures
-    # List files in data directory
-    file_list = os.listdir("data//fixtures")
-
-    # Sort and select first (latest) data set
-    file_list.sort(reverse=True)
-    file_list = file_list[0]
-
-    # Import data
-    path = f'data/fixtures/{file_list}'
-    with open(path) as f:
-        fixtures = json.load(f)
-
-    return data, fixtures
-
-
-# Get team short names
-def get_teams(data):
-    teams = []
-    for i in data['teams']:
-        teams.append(i['short_name'])
-    teams = tuple(teams)
-    return teams
-
-
-# Create look up for team IDs
-
-# Create look up dict
-def add_team_kpis(data):
-    name_lookup = {}
-    kpis_to_add = ['short_name',
-                   'strength_overall_home',
-                   'strength_overall_away',
-                   'strength_attack_home',
-                   'strength_attack_away',
-                   'strength_defence_home',
-                   'strength_defence_away']
-
-    for j in kpis_to_add:
-        for i in data['teams']:
-            id = i['id']
-            kpi_value = i[j]
-            if id not in name_lookup.keys():
-                name_lookup[id] = {}
-            name_lookup[id][j] = kpi_value
-
-    return name_lookup
-
-
-# Add additional information to fixtures
-def update_fixture_information(data, fixtures, custom_kpi):
-    name_lookup = add_team_kpis(data)
-
-    for i in fixtures:
-        # Away team
-        # Select away team ID
-        team_a_id = i['team_a']
-
-        # Add team short name
-        kpi_key = 'short_name'
-        kpi_name = 'team_a_short_name'
-        kpi_value = name_lookup[team_a_id][kpi_key]
-        i[kpi_name] = kpi_value
-
-        # Add custom KPI
-        kpi_name = 'team_h_custom_kpi'  # Note we are defining "h" here as this this will be the stats for the opponant
-        i[kpi_name] = custom_kpi[kpi_value]
-
-        # Add strength attack
-        kpi_key = 'strength_attack_away'
-        kpi_name = 'team_h_strength_attack'  # Note we are defining "h" here as this this will be the stats for the opponant
-        kpi_value = name_lookup[team_a_id][kpi_key]
-        i[kpi_name] = kpi_value
-
-        # Add strength overall
-        kpi_key = 'strength_overall_away'
-        kpi_name = 'team_h_strength_overall'  # Note we are defining "h" here as this this will be the stats for the opponant
-        kpi_value = name_lookup[team_a_id][kpi_key]
-        i[kpi_name] = kpi_value
-
-        # Home team
-        team_h_id = i['team_h']
-
-        # Add team short name
-        kpi_key = 'short_name'
-        kpi_name = 'team_h_short_name'
-        kpi_value = name_lookup[team_h_id][kpi_key]
-        i[kpi_name] = kpi_value
-
-        # Add custom KPI
-        kpi_name = 'team_a_custom_kpi'  # Note we are defining "h" here as this this will be the stats for the opponant
-        i[kpi_name] = custom_kpi[kpi_value]
-
-        # Add strength attack
-        kpi_key = 'strength_attack_home'
-        kpi_name = 'team_a_strength_attack'  # Note we are defining "h" here as this this will be the stats for the opponant
-        kpi_value = name_lookup[team_h_id][kpi_key]
-        i[kpi_name] = kpi_value
-
-        # Add strength overall
-        kpi_key = 'strength_overall_home'
-        kpi_name = 'team_a_strength_overall'  # Note we are defining "h" here as this this will be the stats for the opponant
-        kpi_value = name_lookup[team_h_id][kpi_key]
-        i[kpi_name] = kpi_value
-
-    return fixtures
-
-
-def multi_gw_check(fix, team, gameweek):
-    if gameweek in fix[team]:
-
-        # Get list of gameweeks
-        key_list = list(fix[team].keys())
-
-        # get last gameweek key
-        key = [k for k in key_list if gameweek == k or k.startswith(f'{gameweek}_')][-1]
-
-        # Redfine new gameweek by appending an '_' and increment integer
-        if '_' in key:
-            new_key = int(key.rsplit('_', 1)[-1]) + 1
-            gameweek_new = f'{gameweek}_{new_key}'
-
-        else:
-            gameweek_new = f'{gameweek}_2'
-
-        return gameweek_new
-
-    else:
-        return gameweek
-
-
-def reshape_fixtures(fixtures, kpi):
-    fix = {}
-    fix_name = {}
-    for i in fixtures:
-        gameweek = str(i['event'])
-
-        # Skip if match not scheduled
-        if gameweek == 'None':
-            continue
-
-        away_team = str(i['team_a_short_name'])
-
-        if away_team not in fix:
-            fix[away_team] = {}
-            fix_name[away_team] = {}
-
-        # check if double gameweek
-        gameweek = multi_gw_check(fix, team=away_team, gameweek=gameweek)
-
-        fix[away_team][gameweek] = i[f'team_a_{kpi}']
-        fix_name[away_team][gameweek] = i[f'team_h_short_name']
-
-        home_team = str(i['team_h_short_name'])
-
-        if home_team not in fix:
-            fix[home_team] = {}
-            fix_name[home_team] = {}
-
-        fix[home_team][gameweek] = i[f'team_h_{kpi}']
-        fix_name[home_team][gameweek] = i[f'team_a_short_name']
-
-    return fix, fix_name
-
-
-def blank_gameweek_calc(fix, fix_name):
-    # Identify max value for kpi
-    max_val = 0
-    for i in fix:
-        for j in fix[i]:
-            if fix[i][j] > max_val:
-                max_val = fix[i][j]
-
-    # ## Identify and fill missing game weeks
-
-    # In[18]:
-
-    bgw = []
-    for i in fix:
-        for j in range(1, 39):
-            if str(j) not in fix[i]:
-                fix[i][str(j)] = max_val
-                bgw.append(str(j))
-    bgw = list(set(bgw))
-    bgw.sort()
-
-    for i in fix_name:
-        for j in range(1, 39):
-            if str(j) not in fix_name[i]:
-                fix_name[i][str(j)] = 'BGW'
-
-    return fix, fix_name, bgw, max_val
-
-
-# Identify multi gameweeks:
-def multi_gw_id(fix):
-    # ## Identify multi gameweeks
-
-    # In[20]:
-
-    mgw = []
-    for i in fix:
-        for j in fix[i]:
-            if '_' in j:
-                gw = j.rsplit('_', 1)[0]
-                mgw.append(gw)
-
-    mgw = list(set(mgw))
-    mgw.sort()
-
-    return mgw
-
-
-# Merge multi gameweeks into one value
-def multi_gameweek_weight(fix):
-    for i in fix:
-        key_list = list(fix[i].keys())
-        for j in range(1, 39):
-            keys = [k for k in key_list if str(j) == k or k.startswith(f'{str(j)}_')]
-            if len(keys) <= 1:
-                continue
-            gameweek = keys[0]
-
-            # Identify total kpi for the multi game week
-            val = 0
-            for k in keys:
-                val += fix[i][k]
-
-            # Average opponent
-            val = val / len(keys)
-
-            # Gameweek weighting
-            val = val / len(keys)
-
-            # Remove keys from dictionary
-            for l in keys:
-                del fix[i][l]
-
-            fix[i][gameweek] = int(val)
-
-    return fix
-
-
-# Reshape data to identify complimenting fixtures
-def fixture_calc(fix, start_gameweek, end_gameweek, mgw, bgw, exclude_gameweeks, skip_multi_gameweeks,
-                 skip_blank_gameweeks):
-    df = pd.DataFrame(fix)
-    df = df.reindex(sorted(df.columns), axis=1)
-    df.index = pd.to_numeric(df.index, errors='coerce')
-
+from utility import cache, engine, metrics, model, parallel, snapshot, store
+
+# Prepared built-in KPIs per data snapshot (current and previous)
+season_cache = cache.LRUCache(max_entries=2)
+
+# Results of complimenting_fixtures_calc, limited by number of entries and/or bytes
+RESULT_CACHE_ENTRIES = int(os.environ.get('FPL_RESULT_CACHE_ENTRIES', 256)) or None
+RESULT_CACHE_BYTES = int(os.environ.get('FPL_RESULT_CACHE_BYTES', 0)) or None
+result_cache = cache.LRUCache(max_entries=RESULT_CACHE_ENTRIES, max_bytes=RESULT_CACHE_BYTES)
+
+# Version of the disk cached results, increase it with any change to what fixture_calc_indexed or compare_teams
+# return so values stored by earlier code are calculated again
+CACHE_VERSION = 1
+
+# Ranked pairs and team comparisons shared by all worker processes and kept across restarts
+disk_cache = store.DiskCache(version=CACHE_VERSION) if store.DISK_CACHE_BYTES else None
+
+
+# Value from the disk cache, calculated and stored there on a miss
+def disk_cached(key, calculate):
+    if disk_cache is None:
+        return calculate()
+
+    value = disk_cache.get(key)
+    if value is None:
+        value = calculate()
+        disk_cache.put(key, value)
+    return value
+
+
+# Disk cache entries of older snapshots are never read again
+@snapshot.on_load
+def purge_disk_cache(season):
+    if disk_cache is not None:
+        disk_cache.purge(season.id)
+
+
+# Cache counters for the /metrics endpoint
+@metrics.collector
+def cache_metrics():
+    stats = {'season': season_cache.stats(), 'result': result_cache.stats()}
+    for name, kind, documentation in (('hits', 'counter', 'Cache lookups that found a value'),
+                                      ('misses', 'counter', 'Cache lookups that found nothing'),
+                                      ('evictions', 'counter', 'Values dropped to stay within the cache limits'),
+                                      ('coalesced', 'counter',
+                                       'Lookups that waited for the value another caller was computing'),
+                                      ('inflight', 'gauge', 'Values being computed'),
+                                      ('entries', 'gauge', 'Values in the cache'),
+                                      ('bytes', 'gauge',
+                                       'Approximate size of the values in the cache, for caches bounded by size')):
+        suffix = '_total' if kind == 'counter' else ''
+        yield (f'fpl_cache_{name}{suffix}', kind, documentation,
+               [({'cache': cache_name}, value[name]) for cache_name, value in stats.items()
+                if value[name] is not None])
+
+
+# Gameweek window the dashboard opens on, from the next gameweek to a few before the end of the season
+# (to half way early in the season)
+def default_window(n_gameweeks, next_gameweek):
+    current_gw = next_gameweek or n_gameweeks
+
+    end_gw = n_gameweeks - 3
+    if current_gw >= n_gameweeks - 3:
+        end_gw = n_gameweeks
+    if current_gw < 10:
+        end_gw = n_gameweeks // 2 - 1
+
+    return current_gw, end_gw
+
+
+# Gameweeks (as int) to include in the calculation
+def select_gameweeks(start_gameweek, end_gameweek, mgw, bgw, exclude_gameweeks, skip_multi_gameweeks,
+                     skip_blank_gameweeks):
     # Remove required weeks
     # Create list of all gameweeks within range
     gameweeks = list(range(start_gameweek, end_gameweek + 1))
@@ -291,40 +95,34 @@ def fixture_calc(fix, start_gameweek, end_gameweek, mgw, bgw, exclude_gameweeks,
     gameweeks = [int(i) for i in gameweeks]
     gameweeks.sort()
 
-    # Filter to only select required gameweeks
-    df = df.loc[gameweeks].sort_index()
+    return gameweeks
 
-    # Calculate differences between teams
 
-    fixture_pair = pd.DataFrame(columns=['TEAM_1', 'TEAM_2', 'VALUE'])
+# Rank the team pairs over the selected gameweeks, answered from the prefix sum range index of prepared fixtures
+# where there is one
+@metrics.timed('fixture_calc_indexed')
+def fixture_calc_indexed(prepared, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                         skip_blank_gameweeks):
+    df = prepared['matrix']
 
-    for i in df.columns[0:]:
-        for j in df.columns[0:]:
-            value = df[[i, j]].min(axis=1).sum()
-            fixture_pair.loc[len(fixture_pair)] = [i, j, value]
+    gameweeks = select_gameweeks(start_gameweek, end_gameweek, prepared['mgw'], prepared['bgw'], exclude_gameweeks,
+                                 skip_multi_gameweeks, skip_blank_gameweeks)
 
-    # Remove cases comparing each team to itself
-    fixture_pair = fixture_pair[fixture_pair['TEAM_1'] != fixture_pair['TEAM_2']]
-    fixture_pair = fixture_pair.reset_index()
+    if prepared['range_index'] is None:
+        # Not indexed (custom KPI), score the selected gameweeks directly
+        df = df.loc[gameweeks]
+        values = parallel.pair_values(df.to_numpy().T)
+    else:
+        # Gameweeks in the window that are not selected are subtracted from the window total
+        excluded = set(range(start_gameweek, end_gameweek + 1)) - set(gameweeks)
+        values = engine.query_range_index(prepared['range_index'], start_gameweek, end_gameweek, excluded)
+        df = df.loc[gameweeks]
 
-    # Remove Duplication
-    fixture_pair[['TEAM_1', 'TEAM_2']] = pd.DataFrame(np.sort(fixture_pair[['TEAM_1', 'TEAM_2']].values))
-    del fixture_pair['index']
-    fixture_pair = fixture_pair.drop_duplicates()
-    fixture_pair = fixture_pair.sort_values('VALUE')
+    fixture_pair = engine.pair_frame(df.columns, values)
 
     return fixture_pair, df
 
 
-def prep_fixture_output_all(fix):
-    for team in fix.keys():
-        for gw in list(fix[team].keys())[::]:
-            if len(gw.split('_')[0]) == 1:
-                fix[team][f'0{gw}'] = fix[team][gw]
-                del fix[team][gw]
-    return fix
-
-
 def compare_fixtures_name(fix, team1, team2):
     comp = {key: {f'{team1}': fix[team1].get(key, '-'), f'{team2}': fix[team2].get(key, '-')} for key in
             sorted(set(list(fix[team1].keys()) + list(fix[team2].keys())))}
@@ -339,6 +137,7 @@ def compare_fixtures_val(fix, team1, team2, val):
     return comp
 
 
+@metrics.timed('prep_fixture_output')
 def prep_fixture_output(fix_name, fix_val, team1, team2, mgw, max_val):
     # Filter fixtures
     df_name = compare_fixtures_name(fix_name, team1, team2)
@@ -405,36 +204,347 @@ def prep_fixture_output(fix_name, fix_val, team1, team2, mgw, max_val):
     return df_name, df_val
 
 
-# Calculate complementing fixtures
-def complimenting_fixtures_calc(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
-                                skip_blank_gameweeks):
-    data, fixtures = load_data()
-    fixtures_updated = update_fixture_information(data, fixtures, custom_kpi)
-    fix, fix_name = reshape_fixtures(fixtures_updated, kpi)
-    fix, fix_name, bgw, max_val = blank_gameweek_calc(fix, fix_name)
+# Custom KPI values only matter when the custom KPI is selected
+def custom_kpi_key(kpi, custom_kpi):
+    if kpi != 'custom_kpi':
+        return None
+    return tuple(sorted(custom_kpi.items()))
+
+
+# Parameters of complimenting_fixtures_calc in a canonical form, so equivalent requests share cache entries
+def canonical_params(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                     skip_blank_gameweeks):
+    start_gameweek = int(start_gameweek)
+    end_gameweek = int(end_gameweek)
+
+    # Sorted, de-duplicated and only those inside the selected window
+    exclude_gameweeks = sorted(set(int(i) for i in exclude_gameweeks))
+    exclude_gameweeks = tuple(i for i in exclude_gameweeks if start_gameweek <= i <= end_gameweek)
+
+    return (kpi, custom_kpi_key(kpi, custom_kpi), start_gameweek, end_gameweek, exclude_gameweeks,
+            bool(skip_multi_gameweeks), bool(skip_blank_gameweeks))
+
 
-    fix_val = prep_fixture_output_all(copy.deepcopy(fix))
-    fix_name = prep_fixture_output_all(fix_name)
+# Team order used for the pair tables (sorted by short name)
+def team_order(teams):
+    return sorted(range(len(teams)), key=lambda t: teams[t])
 
-    mgw = multi_gw_id(copy.deepcopy(fix))
-    fix = multi_gameweek_weight(copy.deepcopy(fix))
-    fixture_pair, all_fixture_vals = fixture_calc(copy.deepcopy(fix), start_gameweek, end_gameweek, mgw, bgw,
-                                                  exclude_gameweeks, skip_multi_gameweeks,
-                                                  skip_blank_gameweeks)
 
-    return fixture_pair, fix_val, fix_name, mgw, bgw, max_val, all_fixture_vals
+# Prepared fixtures for one KPI: display dictionaries, teams x gameweeks matrix and pair range index
+def prepared_fixtures(teams, weighted, range_index, fix_val, fix_name, mgw, bgw, max_val):
+    order = team_order(teams)
+    df = pd.DataFrame(weighted[order].T,
+                      index=pd.Index(np.arange(1, weighted.shape[-1] + 1)),
+                      columns=[teams[t] for t in order])
 
+    return {'fix_val': fix_val, 'fix_name': fix_name, 'mgw': mgw, 'bgw': bgw, 'max_val': max_val,
+            'matrix': df, 'range_index': range_index}
 
+
+# Season prepared most recently, the next snapshot is updated from it if the league shape is the same
+_last_prepared = None
+
+season_preparations = metrics.Counter('fpl_season_preparations_total',
+                                      'Snapshots prepared, in full or updated from the previous snapshot', ['mode'])
+
+
+# All built-in KPIs for a snapshot, computed together when the snapshot loads
+# Also holds the KPI independent structures custom KPIs are mapped onto
+@snapshot.on_load
+@metrics.timed('prepare_season')
+def prepare_season(season):
+    def prepare():
+        global _last_prepared
+
+        previous = _last_prepared
+        prepared = None if previous is None else update_season(previous, season)
+        if prepared is None:
+            prepared = build_season(season)
+            season_preparations.inc('full')
+        else:
+            season_preparations.inc('incremental')
+
+        _last_prepared = prepared
+        return prepared
+
+    return season_cache.get_or_compute(season.id, prepare)
+
+
+# Drop everything derived from the snapshots in this process, the next season is prepared in full
+def clear_caches():
+    global _last_prepared
+
+    season_cache.clear()
+    result_cache.clear()
+    _last_prepared = None
+
+
+# KPI x team x gameweek x fixture slot values (of some teams, rows of the team table) and the highest value of each
+# KPI and team, the blank gameweek value is the highest of the teams'
+def season_values(arrays, rows=slice(None)):
+    values = np.stack([arrays[f'kpi_{kpi}'][rows] for kpi in model.KPIS])
+    return values, model.team_max_values(values, arrays['fixture_count'][rows])
+
+
+def build_season(season):
+    arrays = season.arrays
+    teams = season.meta['teams']
+    fixture_count = arrays['fixture_count']
+    values, team_max = season_values(arrays)
+    max_vals = team_max.max(axis=-1, initial=0)
+
+    # KPI x team x gameweek values with multi gameweeks merged, and the pair prefix sums of every KPI at once
+    weighted = model.weighted_values(values, fixture_count, max_vals)
+    range_index = engine.build_range_index(weighted[:, team_order(teams)])
+
+    # Opponents and display layout are the same for every KPI
+    layout = model.display_layout(fixture_count, values.shape[-1])
+    fix_name = model.fixture_name_dict(arrays['opponent'], layout, teams)
+    fix_vals = [model.fixture_value_dict(values[k], layout, teams, max_vals[k].item()) for k in range(len(model.KPIS))]
+
+    return season_prepared(season, team_max, weighted, range_index, model.custom_opponent_index(arrays['opponent']),
+                           layout, fix_name, fix_vals)
+
+
+# Prepare a snapshot from the previous one by comparing their arrays
+# Only the teams with changed fixtures get new values and display dictionaries, and only their pairs are scored
+# again, from the first changed gameweek on. None if the league shape or blank gameweek value changed.
+@metrics.timed('update_season')
+def update_season(previous, season):
+    arrays = season.arrays
+    old = previous['arrays']
+    teams = season.meta['teams']
+    if tuple(teams) != previous['teams'] or arrays['opponent'].shape != old['opponent'].shape:
+        return None
+
+    cells = model.changed_cells(old, arrays)
+    rows = np.flatnonzero(cells.any(axis=1))
+    if len(rows) == 0:
+        return season_prepared(season, previous['team_max'], previous['weighted'], previous['range_index'],
+                               previous['opponent_index'], previous['layout'], previous['fix_name'],
+                               [previous['kpis'][kpi]['fix_val'] for kpi in model.KPIS])
+
+    # The blank gameweek value of each KPI, from the changed teams' highest values and the others' previous ones
+    fixture_count = arrays['fixture_count']
+    values, rows_max = season_values(arrays, rows)
+    team_max = previous['team_max'].copy()
+    team_max[:, rows] = rows_max
+    max_vals = team_max.max(axis=-1, initial=0)
+    if not np.array_equal(max_vals, previous['team_max'].max(axis=-1, initial=0)):
+        return None
+
+    weighted = previous['weighted'].copy()
+    weighted[:, rows] = model.weighted_values(values, fixture_count[rows], max_vals)
+
+    opponent_index = previous['opponent_index'].copy()
+    opponent_index[rows] = model.custom_opponent_index(arrays['opponent'][rows], len(teams))
+
+    # Rows of the pair index are teams in sorted order
+    order = team_order(teams)
+    first_gameweek = int(np.flatnonzero(cells.any(axis=0))[0]) + 1
+    range_index = engine.update_range_index(previous['range_index'], weighted, np.argsort(order)[rows],
+                                            first_gameweek, order)
+
+    # Dictionaries of the other teams are shared with the previous snapshot
+    rows = rows.tolist()
+    layout = model.update_layout(previous['layout'], fixture_count, arrays['opponent'].shape[-1], rows)
+    fix_name = dict(previous['fix_name'])
+    fix_name.update(model.fixture_name_dict(arrays['opponent'], layout, teams, rows))
+    fix_vals = []
+    for k, kpi in enumerate(model.KPIS):
+        fix_val = dict(previous['kpis'][kpi]['fix_val'])
+        fix_val.update(model.fixture_value_dict(arrays[f'kpi_{kpi}'], layout, teams, max_vals[k].item(), rows))
+        fix_vals.append(fix_val)
+
+    return season_prepared(season, team_max, weighted, range_index, opponent_index, layout, fix_name, fix_vals)
+
+
+def season_prepared(season, team_max, weighted, range_index, opponent_index, layout, fix_name, fix_vals):
+    arrays = season.arrays
+    teams = season.meta['teams']
+    max_vals = team_max.max(axis=-1, initial=0)
+
+    prepared = {'layout': layout,
+                'opponent_index': opponent_index,
+                'fix_name': fix_name,
+                'bgw': model.gameweek_list(arrays['bgw']),
+                'mgw': model.gameweek_list(arrays['mgw']),
+                'kpis': {},
+                # What the next snapshot is updated from
+                'arrays': arrays,
+                'teams': tuple(teams),
+                'team_max': team_max,
+                'weighted': weighted,
+                'range_index': range_index}
+
+    for k, kpi in enumerate(model.KPIS):
+        max_val = max_vals[k].item()
+        prepared['kpis'][kpi] = prepared_fixtures(teams, weighted[k], engine.select_index(range_index, k),
+                                                  fix_vals[k], fix_name, prepared['mgw'], prepared['bgw'], max_val)
+
+    return prepared
+
+
+# Steps of the calculation that only depend on the data snapshot and KPI
+# A custom KPI is mapped onto the season's fixture slots with one gather, pairs are then scored directly
+@metrics.timed('prepare_fixtures')
+def prepare_fixtures(season, kpi, custom_kpi):
+    season_prepared = prepare_season(season)
+    if kpi != 'custom_kpi':
+        return season_prepared['kpis'][kpi]
+
+    teams = season.meta['teams']
+    fixture_count = season.arrays['fixture_count']
+
+    values = model.custom_kpi_values(season_prepared['opponent_index'], teams, custom_kpi)
+    max_val = model.blank_value(values, fixture_count)
+    fix_val = model.fixture_value_dict(values, season_prepared['layout'], teams, max_val)
+    weighted = model.weighted_values(values, fixture_count, max_val)
+
+    return prepared_fixtures(teams, weighted, None, fix_val, season_prepared['fix_name'], season_prepared['mgw'],
+                             season_prepared['bgw'], max_val)
+
+
+# Calculate complementing fixtures, from the current snapshot unless a season snapshot is given
+# Returned fixture dictionaries are shared between calls and must not be modified
+@metrics.timed('complimenting_fixtures_calc')
+def complimenting_fixtures_calc(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                                skip_blank_gameweeks, season=None):
+    season = season or snapshot.get_snapshot()
+
+    # Results from an older snapshot are dropped
+    result_cache.validate(season.id)
+    params = canonical_params(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                              skip_blank_gameweeks)
+    key = (season.id,) + params
+
+    # Concurrent requests with the same parameters share one calculation
+    def calculate():
+        prepared = prepare_fixtures(season, kpi, custom_kpi)
+
+        # Only the ranked pairs and window values are stored on disk, the rest is shared by the snapshot's results
+        fixture_pair, all_fixture_vals = disk_cached(key, lambda: fixture_calc_indexed(
+            prepared, params[2], params[3], [str(i) for i in params[4]], params[5], params[6]))
+
+        return (fixture_pair, prepared['fix_val'], prepared['fix_name'], prepared['mgw'], prepared['bgw'],
+                prepared['max_val'], all_fixture_vals)
+
+    return result_cache.get_or_compute(key, calculate)
+
+
+# Compare two teams over the window: opponents (blank gameweeks are 'BGW') and values per gameweek,
+# and the best opponent each gameweek. Returns (fix_name, fix_val, mgw, bgw), shared between calls.
+# Only needs the snapshot's prepared fixtures of the KPI, not the ranked pairs
+@metrics.timed('compare_teams')
+def compare_teams(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                  skip_blank_gameweeks, team1, team2):
+    season = snapshot.get_snapshot()
+    result_cache.validate(season.id)
+    params = canonical_params(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                              skip_blank_gameweeks)
+    key = (season.id, 'compare', team1, team2) + params
+
+    def compare():
+        prepared = prepare_fixtures(season, kpi, custom_kpi)
+        mgw, bgw = prepared['mgw'], prepared['bgw']
+
+        fix_name, fix_val = prep_fixture_output(prepared['fix_name'], prepared['fix_val'], team1, team2, mgw,
+                                                prepared['max_val'])
+        window = (params[2], params[3], [str(i) for i in params[4]], params[5], params[6], mgw, bgw,
+                  season.meta['n_gameweeks'])
+        return filter_fixtures(fix_name, *window), filter_fixtures(fix_val, *window), mgw, bgw
+
+    return result_cache.get_or_compute(key, lambda: disk_cached(key, compare))
+
+
+# Default number of rotations returned by rotation_calc
+ROTATION_TOP_K = 50
+
+
+# Best rotations of group_size teams (e.g. three or four defenders rotated each gameweek)
+# A group's value per gameweek is its lowest value, or the sum of its best_of lowest values if more than one plays
+@metrics.timed('rotation_calc')
+def rotation_calc(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                  skip_blank_gameweeks, group_size=3, best_of=1, top_k=ROTATION_TOP_K):
+    season = snapshot.get_snapshot()
+
+    result_cache.validate(season.id)
+    params = canonical_params(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                              skip_blank_gameweeks)
+    key = (season.id, 'rotation', int(group_size), int(best_of), int(top_k)) + params
+
+    def calculate():
+        prepared = prepare_fixtures(season, kpi, custom_kpi)
+        gameweeks = select_gameweeks(params[2], params[3], prepared['mgw'], prepared['bgw'],
+                                     [str(i) for i in params[4]], params[5], params[6])
+        df = prepared['matrix'].loc[gameweeks]
+
+        groups, values = parallel.top_groups(df.to_numpy().T, int(group_size), int(top_k), int(best_of))
+        return engine.group_frame(df.columns, groups, values)
+
+    return result_cache.get_or_compute(key, calculate)
+
+
+# Default number of player pairs returned by player_pair_calc
+PLAYER_PAIR_TOP_K = 50
+
+
+# Best pairs of players to rotate, e.g. two goalkeepers, costing at most budget (in millions) together
+# positions limits the players to those positions (short names from element_types, e.g. ['GKP'])
+# A player pair has the value of its teams' pair, players of the same team are not paired
+@metrics.timed('player_pair_calc')
+def player_pair_calc(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                     skip_blank_gameweeks, positions=None, budget=None, top_k=PLAYER_PAIR_TOP_K):
+    season = snapshot.get_snapshot()
+
+    result_cache.validate(season.id)
+    params = canonical_params(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
+                              skip_blank_gameweeks)
+    positions = None if positions is None else tuple(sorted(set(positions)))
+    budget = None if budget is None else int(round(float(budget) * 10))
+    key = (season.id, 'player_pair', positions, budget, int(top_k)) + params
+
+    def calculate():
+        # Team pair values are calculated (or cached) once and shared by all players of the teams
+        fixture_pair = complimenting_fixtures_calc(kpi, custom_kpi, start_gameweek, end_gameweek, exclude_gameweeks,
+                                                   skip_multi_gameweeks, skip_blank_gameweeks)[0]
+        teams = season.meta['teams']
+        team_values = engine.pair_matrix(len(teams), fixture_pair['VALUE'].sort_index().to_numpy())
+
+        # Pair tables are in team_order, players refer to rows of the team table
+        team_rank = np.argsort(team_order(teams))
+        arrays = season.arrays
+        players = np.arange(len(arrays['player_id']))
+        if positions is not None:
+            position_rows = [season.meta['positions'].index(i) for i in positions]
+            players = players[np.isin(arrays['player_position'], position_rows)]
+
+        items, values, cost = engine.top_item_pairs(team_values, team_rank[arrays['player_team'][players]],
+                                                    arrays['player_cost'][players], int(top_k), budget)
+        items = players[items]
+
+        names = np.array(season.meta['players'], dtype=object)
+        team_names = np.array(teams, dtype=object)
+        return pd.DataFrame({'PLAYER_1': names[items[:, 0]],
+                             'TEAM_1': team_names[arrays['player_team'][items[:, 0]]],
+                             'PLAYER_2': names[items[:, 1]],
+                             'TEAM_2': team_names[arrays['player_team'][items[:, 1]]],
+                             'COST': cost / 10,
+                             'VALUE': values.astype(fixture_pair['VALUE'].dtype)})
+
+    return result_cache.get_or_compute(key, calculate)
+
+
+@metrics.timed('filter_fixtures')
 def filter_fixtures(df, start_gameweek, end_gameweek, exclude_gameweeks, skip_multi_gameweeks,
-                    skip_blank_gameweeks, mgw, bgw):
+                    skip_blank_gameweeks, mgw, bgw, n_gameweeks):
     # Add any missing gameweeks
-
-    all_gw = list(map(str, range(1, 39)))
+    all_gw = list(map(str, range(1, n_gameweeks + 1)))
     for i in all_gw:
         if len(i) == 1:
             i = f'0{i}'
         if i not in df.columns:
-            df[i] = ['-', '-', '-']
+            df[i] = ['-'] * len(df)
     df = df.reindex(sorted(df.columns), axis=1)
 
     cols = df.columns
@@ -454,7 +564,7 @@ def filter_fixtures(df, start_gameweek, end_gameweek, exclude_gameweeks, skip_mu
 
     df = df.drop(exclude_gameweeks, axis=1, errors='ignore')
 
-    df = df[df.columns & list(map(str, range(start_gameweek, end_gameweek + 1)))]
+    df = df[df.columns.intersection(list(map(str, range(start_gameweek, end_gameweek + 1))))]
 
     return df
 
@@ -0,0 +1,159 @@
+import bisect
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Default histogram buckets, in seconds
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Payload size buckets, in bytes
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Counter per combination of label values, e.g. cache hits per cache
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_labels(self.label_names, k)} {_number(v)}' for k, v in sorted(values.items())]
+
+
+# Histogram per combination of label values, e.g. time per pipeline stage
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [[0] * len(self.buckets), 0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    # Time the block, also when it raises
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self._lock:
+            values = {k: ([*v[0]], v[1], v[2]) for k, v in self._values.items()}
+
+        lines = []
+        for label_values, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, label_values, [("le", _number(bound))])}'
+                             f' {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, label_values)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, label_values)} {count}')
+        return lines
+
+
+def register(metric):
+    with _lock:
+        if metric.name in _metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        _metrics[metric.name] = metric
+    return metric
+
+
+# Register a function returning current values at scrape time, as (name, kind, documentation, samples)
+# with samples a list of (labels dict, value), e.g. for counters kept by another object
+def collector(function):
+    with _lock:
+        _collectors.append(function)
+    return function
+
+
+# All metrics in the Prometheus text exposition format
+def render():
+    with _lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines += metric.samples()
+
+    for function in collectors:
+        for name, kind, documentation, samples in function():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+stage_seconds = Histogram('fpl_stage_seconds', 'Time spent in each stage of the calculation', ['stage'])
+callback_seconds = Histogram('fpl_callback_seconds', 'Time spent in each Dash callback', ['callback'])
+
+
+# Decorator timing every call of a function as a pipeline stage (or with another histogram, e.g. a callback)
+def timed(name, histogram=stage_seconds):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
@@ -0,0 +1,287 @@
+import numpy as np
+
+# Built-in KPIs, the value for a team in a fixture describes its opponent
+KPIS = ('difficulty', 'strength_attack', 'strength_overall')
+
+TEAM_STRENGTHS = ('strength_overall_home',
+                  'strength_overall_away',
+                  'strength_attack_home',
+                  'strength_attack_away',
+                  'strength_defence_home',
+                  'strength_defence_away')
+
+
+# Team table as columns, in the order of data['teams']
+def team_table(data):
+    teams = data['teams']
+    table = {'id': np.fromiter((i['id'] for i in teams), dtype=np.int32, count=len(teams)),
+             'short_name': tuple(i['short_name'] for i in teams)}
+    for kpi in TEAM_STRENGTHS:
+        table[kpi] = np.fromiter((i[kpi] for i in teams), dtype=np.int32, count=len(teams))
+    return table
+
+
+# Fixtures as columns, unscheduled matches have event 0
+def fixture_table(fixtures):
+    columns = {'id': 'id',
+               'event': 'event',
+               'team_h': 'team_h',
+               'team_a': 'team_a',
+               'team_h_difficulty': 'team_h_difficulty',
+               'team_a_difficulty': 'team_a_difficulty'}
+    return {name: np.fromiter((i[key] or 0 for i in fixtures), dtype=np.int32, count=len(fixtures))
+            for name, key in columns.items()}
+
+
+# Map FPL team IDs to rows of the team table
+def team_index(team_ids):
+    index = np.full(int(team_ids.max()) + 1, -1, dtype=np.int32)
+    index[team_ids] = np.arange(len(team_ids), dtype=np.int32)
+    return index
+
+
+# Fixtures joined with both teams' short names and strengths
+# Columns describe the opponent: team_h_<kpi> is the value for the home team, so a stat of the away team
+def enrich_fixture_table(teams, fixtures):
+    index = team_index(teams['id'])
+    home = index[fixtures['team_h']]
+    away = index[fixtures['team_a']]
+    short_name = np.array(teams['short_name'], dtype=object)
+
+    table = dict(fixtures)
+    table['team_h_short_name'] = short_name[home]
+    table['team_a_short_name'] = short_name[away]
+
+    # Strength of the opponent for the venue they play at
+    for kpi in ('strength_attack', 'strength_overall'):
+        table[f'team_h_{kpi}'] = teams[f'{kpi}_away'][away]
+        table[f'team_a_{kpi}'] = teams[f'{kpi}_home'][home]
+
+    return table
+
+
+# Player columns in the order of data['elements'], team and position as rows of the team and position tables
+# Cost is in tenths of a million, as in the FPL API
+def player_table(data):
+    elements = data['elements']
+    team_rows = team_index(np.array([i['id'] for i in data['teams']], dtype=np.int32))
+    position_rows = team_index(np.array([i['id'] for i in data['element_types']], dtype=np.int32))
+
+    return {'player_id': np.fromiter((i['id'] for i in elements), dtype=np.int32, count=len(elements)),
+            'player_team': team_rows[np.fromiter((i['team'] for i in elements), dtype=np.int32,
+                                                 count=len(elements))].astype(np.int16),
+            'player_position': position_rows[np.fromiter((i['element_type'] for i in elements), dtype=np.int32,
+                                                         count=len(elements))].astype(np.int8),
+            'player_cost': np.fromiter((i['now_cost'] for i in elements), dtype=np.int16, count=len(elements))}
+
+
+# Number of gameweeks in the season, the events or any later gameweek fixtures are scheduled in
+def gameweek_total(data, fixtures):
+    return max(len(data['events']), max((i['event'] or 0 for i in fixtures), default=0))
+
+
+# Dense team x gameweek x fixture slot arrays for the season
+# Slots are filled in fixture order, each team's away/home fixtures taking the next free slot of the gameweek
+def build_season_arrays(data, fixtures):
+    teams = team_table(data)
+    fx = enrich_fixture_table(teams, fixture_table(fixtures))
+
+    n_teams = len(teams['id'])
+    n_gameweeks = gameweek_total(data, fixtures)
+    team_rows = team_index(teams['id'])
+
+    # Skip if match not scheduled
+    scheduled = fx['event'] > 0
+    fx = {k: v[scheduled] for k, v in fx.items()}
+    n_fixtures = len(fx['id'])
+
+    # One row per team per fixture, away team first
+    team = np.empty(2 * n_fixtures, dtype=np.int32)
+    team[0::2] = team_rows[fx['team_a']]
+    team[1::2] = team_rows[fx['team_h']]
+    opponent = np.empty_like(team)
+    opponent[0::2] = team[1::2]
+    opponent[1::2] = team[0::2]
+    home = np.zeros(2 * n_fixtures, dtype=bool)
+    home[1::2] = True
+    gameweek = np.repeat(fx['event'] - 1, 2)
+    fixture_id = np.repeat(fx['id'], 2)
+
+    # Slot of each row within its team and gameweek, in fixture order
+    cell = team * n_gameweeks + gameweek
+    order = np.argsort(cell, kind='stable')
+    sorted_cell = cell[order]
+    group_start = np.flatnonzero(np.r_[True, sorted_cell[1:] != sorted_cell[:-1]])
+    group_size = np.diff(np.r_[group_start, len(cell)])
+    slot = np.empty_like(cell)
+    slot[order] = np.arange(len(cell)) - np.repeat(group_start, group_size)
+
+    fixture_count = np.bincount(cell, minlength=n_teams * n_gameweeks).reshape(n_teams, n_gameweeks)
+    n_slots = max(int(fixture_count.max(initial=0)), 1)
+
+    arrays = {'team_id': teams['id'],
+              'team_strength': np.stack([teams[kpi] for kpi in TEAM_STRENGTHS], axis=1),
+              'fixture_count': fixture_count.astype(np.int8),
+              'opponent': np.full((n_teams, n_gameweeks, n_slots), -1, dtype=np.int16),
+              'home': np.zeros((n_teams, n_gameweeks, n_slots), dtype=bool),
+              'fixture_id': np.full((n_teams, n_gameweeks, n_slots), -1, dtype=np.int32)}
+
+    cells = (team, gameweek, slot)
+    arrays['opponent'][cells] = opponent
+    arrays['home'][cells] = home
+    arrays['fixture_id'][cells] = fixture_id
+
+    # KPI values per slot, from the enriched fixture columns of each side
+    for kpi in KPIS:
+        kpi_values = np.empty(2 * n_fixtures, dtype=np.int32)
+        kpi_values[0::2] = fx[f'team_a_{kpi}']
+        kpi_values[1::2] = fx[f'team_h_{kpi}']
+        arrays[f'kpi_{kpi}'] = np.zeros((n_teams, n_gameweeks, n_slots), dtype=np.int32)
+        arrays[f'kpi_{kpi}'][cells] = kpi_values
+
+    # Blank (a team has no fixture) and multi (a team has more than one) gameweeks
+    arrays['bgw'] = (fixture_count == 0).any(axis=0)
+    arrays['mgw'] = (fixture_count > 1).any(axis=0)
+
+    arrays.update(player_table(data))
+
+    return arrays
+
+
+# Small descriptive information stored alongside the arrays
+def season_meta(data, fixtures):
+    next_gameweek = None
+    for i in data['events']:
+        if i['is_next']:
+            next_gameweek = i['id']
+
+    return {'teams': [i['short_name'] for i in data['teams']],
+            'players': [i['web_name'] for i in data['elements']],
+            'positions': [i['singular_name_short'] for i in data['element_types']],
+            'n_gameweeks': gameweek_total(data, fixtures),
+            'next_gameweek': next_gameweek}
+
+
+# Which fixture slots of each team and gameweek hold a fixture
+def slot_mask(fixture_count, n_slots):
+    return np.arange(n_slots) < fixture_count[..., None]
+
+
+# Opponent of each fixture slot as an index into the custom KPI values, empty slots point at an extra 0 value
+# n_teams is needed when opponent only holds some teams' rows
+def custom_opponent_index(opponent, n_teams=None):
+    n_teams = opponent.shape[0] if n_teams is None else n_teams
+    return np.where(opponent >= 0, opponent, n_teams).astype(np.intp)
+
+
+# Custom KPI values of each fixture slot with a single gather from the team values
+def custom_kpi_values(opponent_index, teams, custom_kpi):
+    custom = np.array([custom_kpi[i] for i in teams] + [0])
+    return custom[opponent_index]
+
+
+# Highest KPI value of any fixture, used as the value of a blank gameweek
+# For a stack of KPIs (KPI x team x gameweek x slot) this is an array with one value per KPI
+def blank_value(values, fixture_count):
+    value = team_max_values(values, fixture_count).max(axis=-1, initial=0)
+    return value.item() if value.ndim == 0 else value
+
+
+# Highest KPI value of each team's fixtures, 0 for a team without any (per KPI for a stack of KPIs)
+def team_max_values(values, fixture_count):
+    return np.where(slot_mask(fixture_count, values.shape[-1]), values, 0).max(axis=(-2, -1), initial=0)
+
+
+# Merge multi gameweeks into one value per team and gameweek
+# The value is the average opponent divided by the number of fixtures, blank gameweeks get blank_value
+# values may be a stack of KPIs, with blank_value then holding one value per KPI
+def weighted_values(values, fixture_count, blank_value):
+    count = fixture_count.astype(np.int64)
+    total = np.where(slot_mask(fixture_count, values.shape[-1]), values, 0).sum(axis=-1)
+    blank_value = np.asarray(blank_value)[..., None, None]
+
+    divisor = np.maximum(count, 1)
+    if np.issubdtype(total.dtype, np.integer):
+        multi = total // (divisor * divisor)
+    else:
+        multi = np.trunc(total / divisor / divisor)
+
+    weighted = np.where(count > 1, multi, total)
+    weighted = np.where(count == 0, blank_value, weighted)
+
+    return weighted
+
+
+# Gameweeks of a mask as a sorted list of strings, e.g. the BGW and MGW lists
+def gameweek_list(mask):
+    gameweeks = [str(i) for i in np.flatnonzero(mask) + 1]
+    gameweeks.sort()
+    return gameweeks
+
+
+# Layout of the per team display dictionaries
+# Keys are two digit gameweeks ('01', '27'), further fixtures in the same gameweek are '27_2', '27_3'
+# Each key points at its team x gameweek x slot position, -1 for a blank gameweek
+def display_layout(fixture_count, n_slots):
+    return [_team_layout(t, counts, n_slots) for t, counts in enumerate(fixture_count.tolist())]
+
+
+# Layout with the rows of some teams rebuilt (e.g. teams with rescheduled fixtures), the others are shared
+def update_layout(layout, fixture_count, n_slots, rows):
+    layout = list(layout)
+    for t in rows:
+        layout[t] = _team_layout(t, fixture_count[t].tolist(), n_slots)
+    return layout
+
+
+def _team_layout(t, counts, n_slots):
+    keys = []
+    positions = []
+    for g, count in enumerate(counts):
+        gameweek = f'{g + 1:02d}'
+        position = (t * len(counts) + g) * n_slots
+        if count == 0:
+            keys.append(gameweek)
+            positions.append(-1)
+        for s in range(count):
+            keys.append(gameweek if s == 0 else f'{gameweek}_{s + 1}')
+            positions.append(position + s)
+    return tuple(keys), np.array(positions, dtype=np.intp)
+
+
+# Per team fixture values for display, blank gameweeks get blank_value
+# rows limits it to some teams (rows of the team table)
+def fixture_value_dict(values, layout, teams, blank_value, rows=None):
+    flat = values.reshape(-1)
+
+    fix_val = {}
+    for t in range(len(teams)) if rows is None else rows:
+        keys, positions = layout[t]
+        team_values = flat[positions].tolist()
+        fix_val[teams[t]] = dict(zip(keys, [blank_value if p < 0 else v for p, v in zip(positions.tolist(),
+                                                                                         team_values)]))
+
+    return fix_val
+
+
+# Per team opponent names for display, keyed as in fixture_value_dict
+def fixture_name_dict(opponent, layout, teams, rows=None):
+    flat = opponent.reshape(-1)
+    names = list(teams) + ['BGW']
+
+    fix_name = {}
+    for t in range(len(teams)) if rows is None else rows:
+        keys, positions = layout[t]
+        opponents = np.where(positions < 0, len(teams), flat[positions]).tolist()
+        fix_name[teams[t]] = dict(zip(keys, [names[o] for o in opponents]))
+
+    return fix_name
+
+
+# Team x gameweek cells whose fixtures were added, removed, rescheduled or changed (e.g. difficulty) between two
+# seasons' arrays, compared slot by slot without sorting or matching fixtures. Both must have the same shape.
+def changed_cells(old, new):
+    slots = old['fixture_id'] != new['fixture_id']
+    for name in ('opponent', 'home') + tuple(f'kpi_{kpi}' for kpi in KPIS):
+        slots |= old[name] != new[name]
+    return slots.any(axis=-1) | (old['fixture_count'] != new['fixture_count'])
@@ -0,0 +1,180 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utility import engine
+
+# Server processes that each keep their own pool (set by gunicorn.conf.py)
+SERVER_WORKERS = int(os.environ.get('FPL_SERVER_WORKERS', 1))
+
+# Worker processes for scoring large sets of teams (or players, or synthetic leagues), in total across the server
+# processes, 1 to always score in process
+PARALLEL_WORKERS = max((int(os.environ.get('FPL_PARALLEL_WORKERS', 0)) or os.cpu_count() or 1) // SERVER_WORKERS, 1)
+
+# Inputs with fewer pair (or group) x gameweek cells than this are scored in process, a pool is slower for them
+PARALLEL_MIN_CELLS = int(os.environ.get('FPL_PARALLEL_MIN_CELLS', 4000000))
+
+# Blocks per worker, more blocks even out the work between workers
+BLOCKS_PER_WORKER = 4
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+# Shared matrix the worker last attached to (name, shared memory, array)
+_attached = None
+
+
+def _get_pool():
+    global _pool, _pool_pid
+
+    with _lock:
+        # A pool must not be used across a fork, e.g. by forked server workers
+        # Its processes are started from a single threaded server process rather than forked from this one, which
+        # may be running other threads (e.g. a threaded server worker)
+        if _pool is None or _pool_pid != os.getpid():
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+            _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS, mp_context=context)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@atexit.register
+def shutdown():
+    global _pool
+
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def use_pool(n_items, n_gameweeks, workers=None):
+    workers = PARALLEL_WORKERS if workers is None else workers
+    return workers > 1 and n_items * n_gameweeks >= PARALLEL_MIN_CELLS
+
+
+# Copy of a matrix in shared memory, workers map it by name instead of receiving a pickled copy with every block
+class SharedMatrix:
+    def __init__(self, matrix):
+        matrix = np.ascontiguousarray(matrix)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        self.spec = (self.memory.name, matrix.shape, matrix.dtype.str)
+        np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=self.memory.buf)[...] = matrix
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Matrix of a SharedMatrix in a worker, the mapping is kept while the same matrix is being scored
+def _attach(spec):
+    global _attached
+
+    name, shape, dtype = spec
+    if _attached is None or _attached[0] != name:
+        if _attached is not None:
+            _attached[1].close()
+        memory = shared_memory.SharedMemory(name=name)
+        matrix = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        matrix.setflags(write=False)
+        _attached = (name, memory, matrix)
+
+    return _attached[2]
+
+
+# Split the first team indices of pairs (or groups) into blocks of about the same amount of work
+# Earlier teams have more pairs, so teams are dealt out in turn rather than in ranges
+def team_blocks(n_teams, n_blocks):
+    n_blocks = max(min(n_blocks, n_teams), 1)
+    return [np.arange(i, n_teams, n_blocks) for i in range(n_blocks)]
+
+
+# Pair indices and values of all pairs whose first team is one of teams
+def _score_pairs(matrix, teams):
+    team_1, team_2, values = [], [], []
+    for team in teams.tolist():
+        others = np.arange(team + 1, matrix.shape[0])
+        team_1.append(np.full(len(others), team))
+        team_2.append(others)
+        values.append(np.minimum(matrix[team], matrix[others]).sum(axis=-1))
+
+    if not values:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=matrix.dtype)
+
+    return np.concatenate(team_1), np.concatenate(team_2), np.concatenate(values)
+
+
+# Block functions take the matrix itself (in process) or the spec of a SharedMatrix (in a worker)
+def _matrix(source):
+    return source if isinstance(source, np.ndarray) else _attach(source)
+
+
+def _pair_block(source, teams):
+    return _score_pairs(_matrix(source), teams)
+
+
+def _group_block(source, group_size, top_k, best_of, teams):
+    return engine.top_groups(_matrix(source), group_size, top_k, best_of, first_teams=teams)
+
+
+# Run a block function over team blocks, in worker processes for large inputs
+def _map_blocks(function, matrix, blocks, args, parallel):
+    if not parallel:
+        return [function(matrix, *args, block) for block in blocks]
+
+    with SharedMatrix(matrix) as shared:
+        futures = [_get_pool().submit(function, shared.spec, *args, block) for block in blocks]
+        return [future.result() for future in futures]
+
+
+# Score all pairs of a teams x gameweeks matrix, the same values as engine.pair_values
+def pair_values(matrix, workers=None):
+    matrix = np.asarray(matrix)
+    n_teams, n_gameweeks = matrix.shape
+    n_pairs = n_teams * (n_teams - 1) // 2
+    if not use_pool(n_pairs, n_gameweeks, workers):
+        return engine.pair_values(matrix)
+
+    workers = PARALLEL_WORKERS if workers is None else workers
+    blocks = team_blocks(n_teams, workers * BLOCKS_PER_WORKER)
+    results = _map_blocks(_pair_block, matrix, blocks, (), True)
+
+    # Back into the upper triangle order of engine.pair_indices
+    team_1, team_2, values = (np.concatenate(i) for i in zip(*results))
+    out = np.empty(n_pairs, dtype=values.dtype)
+    out[team_1 * n_teams - team_1 * (team_1 + 1) // 2 + team_2 - team_1 - 1] = values
+    return out
+
+
+# engine.top_groups with the search split by first team across worker processes for large inputs
+def top_groups(matrix, group_size, top_k, best_of=1, workers=None):
+    matrix = np.asarray(matrix)
+    n_teams, n_gameweeks = matrix.shape
+
+    # Rough amount of work, the number of groups before pruning
+    n_groups = 1
+    for i in range(min(group_size, n_teams)):
+        n_groups = n_groups * (n_teams - i) // (i + 1)
+
+    if not use_pool(n_groups, n_gameweeks, workers):
+        return engine.top_groups(matrix, group_size, top_k, best_of)
+
+    workers = PARALLEL_WORKERS if workers is None else workers
+    blocks = team_blocks(n_teams - group_size + 1, workers * BLOCKS_PER_WORKER)
+    results = _map_blocks(_group_block, matrix, blocks, (group_size, top_k, best_of), True)
+
+    # Blocks hold different groups, so the global top_k is among the blocks' top_k
+    groups = np.concatenate([groups for groups, _ in results])
+    values = np.concatenate([values for _, values in results])
+    order = np.lexsort(tuple(groups.T[::-1]) + (values,))[:top_k]
+    return groups[order], values[order]
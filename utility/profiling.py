@@ -0,0 +1,172 @@
+import cProfile
+import io
+import itertools
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections import deque
+from datetime import datetime
+
+from flask import Response, abort, g, request
+
+# Profile every callback request
+PROFILE_ALL = os.environ.get('FPL_PROFILE', '') not in ('', '0')
+
+# Token for the admin routes, also the value of the header that profiles a single request
+# Without a token the header is ignored and the admin routes are not served
+ADMIN_TOKEN = os.environ.get('FPL_ADMIN_TOKEN') or None
+
+PROFILE_HEADER = 'X-FPL-Profile'
+
+# Number of profiles kept, the oldest is dropped first
+PROFILE_BUFFER = int(os.environ.get('FPL_PROFILE_BUFFER', 20))
+
+# Lines of the text report
+REPORT_LINES = 40
+
+_lock = threading.Lock()
+_profiles = deque(maxlen=PROFILE_BUFFER)
+_ids = itertools.count(1)
+
+# Held by the request being profiled
+_profiling = threading.Lock()
+
+
+def profiles():
+    with _lock:
+        return list(_profiles)
+
+
+def _is_callback():
+    return request.path.endswith('/_dash-update-component')
+
+
+def _requested():
+    return PROFILE_ALL or (ADMIN_TOKEN is not None and request.headers.get(PROFILE_HEADER) == ADMIN_TOKEN)
+
+
+# Memory tracing is process wide, it only runs while the profiled request does
+def _start_tracing():
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    return started
+
+
+def _stop_tracing(started):
+    peak = tracemalloc.get_traced_memory()[1]
+    if started:
+        tracemalloc.stop()
+    return peak
+
+
+# One request is profiled at a time, so requests running alongside it do not reset its peak memory
+# Requests arriving while one is profiled are not profiled
+def start_profile():
+    if not _is_callback() or not _requested() or not _profiling.acquire(blocking=False):
+        return
+
+    started = _start_tracing()
+    profile = cProfile.Profile()
+    g.fpl_profile = (profile, time.perf_counter(), started)
+    profile.enable()
+
+
+def stop_profile(exc=None):
+    state = g.pop('fpl_profile', None)
+    if state is None:
+        return
+
+    profile, start, started = state
+    profile.disable()
+    duration = time.perf_counter() - start
+    peak = _stop_tracing(started)
+    _profiling.release()
+
+    body = request.get_json(silent=True) or {}
+
+    # pstats.Stats takes the stats out of the profile, so keep a copy first
+    profile.create_stats()
+    stats = marshal.dumps(profile.stats)
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(REPORT_LINES)
+
+    record = {'id': next(_ids),
+              'time': datetime.now().isoformat(timespec='seconds'),
+              'output': body.get('output'),
+              'inputs': body.get('inputs'),
+              'error': None if exc is None else repr(exc),
+              'seconds': duration,
+              'peak_memory_bytes': peak,
+              'report': report.getvalue(),
+              'stats': stats}
+    with _lock:
+        _profiles.append(record)
+
+
+def _summary(record):
+    return {k: v for k, v in record.items() if k not in ('inputs', 'report', 'stats')}
+
+
+def _find(profile_id):
+    for record in profiles():
+        if record['id'] == profile_id:
+            return record
+    abort(404)
+
+
+# Only from the Authorization header, a token in the URL would end up in access logs and browser history
+def _check_token():
+    if ADMIN_TOKEN is None or request.headers.get('Authorization') != f'Bearer {ADMIN_TOKEN}':
+        abort(404)
+
+
+def list_profiles():
+    _check_token()
+    return Response(json.dumps([_summary(i) for i in profiles()], indent=2), content_type='application/json')
+
+
+# Text report, or with ?format=prof the stats file for pstats / snakeviz
+def get_profile(profile_id):
+    _check_token()
+    record = _find(profile_id)
+    if request.args.get('format') == 'prof':
+        return Response(record['stats'], content_type='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename=profile_{profile_id}.prof'})
+
+    summary = json.dumps(dict(_summary(record), inputs=record['inputs']), indent=2)
+    return Response(f'{summary}\n\n{record["report"]}', content_type='text/plain; charset=utf-8')
+
+
+# All kept profiles as a zip of stats files and reports
+def download_profiles():
+    _check_token()
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for record in profiles():
+            archive.writestr(f'profile_{record["id"]}.prof', record['stats'])
+            archive.writestr(f'profile_{record["id"]}.txt', record['report'])
+        archive.writestr('profiles.json', json.dumps([_summary(i) for i in profiles()], indent=2))
+
+    return Response(content.getvalue(), content_type='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=profiles.zip'})
+
+
+# Profile callback requests of a Flask server, the hooks are only added if profiling can be turned on
+def init_app(server):
+    if not PROFILE_ALL and ADMIN_TOKEN is None:
+        return
+
+    server.before_request(start_profile)
+    server.teardown_request(stop_profile)
+
+    if ADMIN_TOKEN is not None:
+        server.add_url_rule('/admin/profiles', 'list_profiles', list_profiles)
+        server.add_url_rule('/admin/profiles/download', 'download_profiles', download_profiles)
+        server.add_url_rule('/admin/profiles/<int:profile_id>', 'get_profile', get_profile)
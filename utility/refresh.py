@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utility import snapshot
+
+API_URL = os.environ.get('FPL_API_URL', 'https://fantasy.premierleague.com/api/')
+
+# Endpoint, directory and file name prefix of each data set
+ENDPOINTS = {'bootstrap_static': ('bootstrap-static/', snapshot.BOOTSTRAP_STATIC_DIR),
+             'fixtures': ('fixtures/', snapshot.FIXTURES_DIR)}
+
+# ETag / Last-Modified of the last response for each data set
+STATE_PATH = 'data/refresh_state.json'
+
+# Seconds to connect and to read a response
+TIMEOUT = (5, 30)
+
+
+# Pooled session retrying connection errors and server errors with exponential backoff
+def create_session(retries=5, backoff_factor=0.5):
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',),
+                  respect_retry_after_header=True)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=len(ENDPOINTS), pool_maxsize=len(ENDPOINTS))
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_PATH):
+    snapshot.atomic_write(path, json.dumps(state, indent=2).encode())
+
+
+# Hash of the latest saved file in a directory, None if there is none
+def latest_hash(directory):
+    try:
+        file_name, _ = snapshot.latest_file(directory)
+    except (OSError, IndexError):
+        return None
+
+    with open(os.path.join(directory, file_name), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Fetch one data set, writing a new dated file only if the content changed
+def refresh_endpoint(session, name, api_url, state, date):
+    endpoint, directory = ENDPOINTS[name]
+    previous = state.get(name, {})
+
+    # Conditional request, the server answers 304 if nothing changed since the last response
+    headers = {}
+    if previous.get('etag'):
+        headers['If-None-Match'] = previous['etag']
+    if previous.get('last_modified'):
+        headers['If-Modified-Since'] = previous['last_modified']
+
+    response = session.get(api_url + endpoint, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304:
+        return name, False, previous
+    response.raise_for_status()
+
+    content = json.dumps(response.json()).encode()
+    content_hash = hashlib.sha256(content).hexdigest()
+    new_state = {'etag': response.headers.get('ETag'),
+                 'last_modified': response.headers.get('Last-Modified')}
+
+    # Same content as the latest file, e.g. the server does not support conditional requests
+    if content_hash == latest_hash(directory):
+        return name, False, new_state
+
+    snapshot.atomic_write(os.path.join(directory, f'{name}_{date}.json'), content)
+
+    return name, True, new_state
+
+
+# Fetch all data sets concurrently, returns the names of the ones that changed
+def refresh(api_url=API_URL, session=None, state_path=STATE_PATH):
+    session = create_session() if session is None else session
+    state = load_state(state_path)
+
+    # Get current date to timestamp data
+    date = datetime.today().strftime("%Y%m%d")
+
+    with ThreadPoolExecutor(max_workers=len(ENDPOINTS)) as executor:
+        futures = [executor.submit(refresh_endpoint, session, name, api_url, state, date) for name in ENDPOINTS]
+        results = [future.result() for future in futures]
+
+    changed = []
+    for name, updated, endpoint_state in results:
+        state[name] = endpoint_state
+        if updated:
+            changed.append(name)
+
+    # Rebuild the binary snapshot the app memory maps, the older ones are no longer used
+    if changed:
+        snapshot.remove_old_snapshots(snapshot.save_binary_snapshot())
+
+    save_state(state, state_path)
+
+    return changed
+
+
+# Refresh every interval seconds, runs in its own process so the app is never blocked
+def run_forever(interval, api_url=API_URL):
+    session = create_session()
+    while True:
+        started = time.time()
+        try:
+            changed = refresh(api_url, session)
+            print(f'{datetime.now():%Y-%m-%d %H:%M:%S} refreshed, changed: {", ".join(changed) or "nothing"}')
+        except Exception:
+            # Keep serving the existing data and try again next time
+            traceback.print_exc()
+
+        time.sleep(max(interval - (time.time() - started), 0))
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import traceback
+from types import MappingProxyType
+
+import numpy as np
+
+from utility import model
+
+BOOTSTRAP_STATIC_DIR = 'data/bootstrap_static'
+FIXTURES_DIR = 'data/fixtures'
+SNAPSHOT_DIR = 'data/snapshot'
+
+# Binary snapshot layout:
+#   magic (8 bytes) | version (uint32) | header length (uint32) | JSON header | arrays
+# The header holds the season meta data and each array's dtype, shape and offset from the start of the file.
+# Arrays are aligned so they can be used straight from a memory map.
+SNAPSHOT_MAGIC = b'FPLSNAP\x00'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_ALIGNMENT = 64
+
+_lock = threading.Lock()
+_current = None
+_on_load = []
+
+
+# Parsed season, shared read only between all callers
+# arrays and meta come from the binary snapshot, the raw JSON is only parsed if data or fixtures are used
+class Snapshot:
+    def __init__(self, key, arrays, meta, data=None, fixtures=None):
+        self.key = key
+        self.id = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        self.arrays = MappingProxyType(arrays)
+        self.meta = freeze(meta)
+        self._data = data
+        self._fixtures = fixtures
+        self._lock = threading.Lock()
+
+    def _load_json(self):
+        with self._lock:
+            if self._data is None:
+                data, fixtures = read_json(self.key)
+                self._data, self._fixtures = freeze(data), freeze(fixtures)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._load_json()
+        return self._data
+
+    @property
+    def fixtures(self):
+        if self._fixtures is None:
+            self._load_json()
+        return self._fixtures
+
+
+# Latest data set in a directory (file names are date stamped), with its modified time
+def latest_file(directory):
+    file_list = [f for f in os.listdir(directory) if f.endswith('.json')]
+
+    # Sort and select first (latest) data set
+    file_list.sort(reverse=True)
+    file_name = file_list[0]
+
+    return file_name, os.stat(os.path.join(directory, file_name)).st_mtime_ns
+
+
+def snapshot_key():
+    return latest_file(BOOTSTRAP_STATIC_DIR) + latest_file(FIXTURES_DIR)
+
+
+# Recursively convert parsed JSON into read only containers
+def freeze(value):
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def read_json(key):
+    bootstrap_static_file, _, fixtures_file, _ = key
+
+    with open(os.path.join(BOOTSTRAP_STATIC_DIR, bootstrap_static_file)) as f:
+        data = json.load(f)
+
+    with open(os.path.join(FIXTURES_DIR, fixtures_file)) as f:
+        fixtures = json.load(f)
+
+    return data, fixtures
+
+
+# Binary snapshot for a pair of JSON files, e.g. fixtures_20210221.json -> season_20210221.snap
+def binary_snapshot_path(key):
+    fixtures_file = key[2]
+    name = os.path.splitext(fixtures_file)[0].replace('fixtures_', 'season_', 1)
+    return os.path.join(SNAPSHOT_DIR, f'{name}.snap')
+
+
+# Write a file so readers only ever see the old or the complete new content
+def atomic_write(path, content):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _align(offset):
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+# Write arrays and meta data as a binary snapshot, atomically replacing any existing file
+def write_binary_snapshot(path, arrays, meta):
+    arrays = {name: np.ascontiguousarray(value) for name, value in arrays.items()}
+
+    # Array offsets depend on the header length, so lay the arrays out relative to the end of the header first
+    layout = {}
+    offset = 0
+    for name, value in arrays.items():
+        offset = _align(offset)
+        layout[name] = {'dtype': value.dtype.str, 'shape': list(value.shape), 'offset': offset}
+        offset += value.nbytes
+
+    # Then move them after the header, growing the space for it until the shifted offsets fit
+    prefix = len(SNAPSHOT_MAGIC) + 8
+    data_start = prefix
+    while True:
+        header = {'meta': meta,
+                  'arrays': {name: dict(value, offset=value['offset'] + data_start) for name, value in layout.items()}}
+        header_bytes = json.dumps(header).encode()
+        if prefix + len(header_bytes) <= data_start:
+            break
+        data_start = _align(prefix + len(header_bytes))
+    layout = header['arrays']
+    header_bytes = header_bytes.ljust(data_start - prefix)
+
+    content = bytearray(data_start + offset)
+    content[:prefix] = SNAPSHOT_MAGIC + struct.pack('<II', SNAPSHOT_VERSION, len(header_bytes))
+    content[prefix:data_start] = header_bytes
+    for name, value in arrays.items():
+        start = layout[name]['offset']
+        content[start:start + value.nbytes] = value.tobytes()
+
+    atomic_write(path, content)
+
+
+# Memory map a binary snapshot, arrays are read only views of the file
+def read_binary_snapshot(path):
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    prefix = len(SNAPSHOT_MAGIC) + 8
+    if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f'{path} is not a season snapshot')
+    version, header_length = struct.unpack('<II', buffer[len(SNAPSHOT_MAGIC):prefix])
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f'{path} has snapshot version {version}, expected {SNAPSHOT_VERSION}')
+
+    header = json.loads(bytes(buffer[prefix:prefix + header_length]))
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        count = int(np.prod(layout['shape']))
+        arrays[name] = np.frombuffer(buffer, dtype=layout['dtype'], count=count,
+                                     offset=layout['offset']).reshape(layout['shape'])
+
+    return header['meta'], arrays
+
+
+# Build the season arrays from the JSON files and save them as a binary snapshot
+def save_binary_snapshot(key=None):
+    key = snapshot_key() if key is None else key
+    data, fixtures = read_json(key)
+
+    arrays = model.build_season_arrays(data, fixtures)
+    meta = model.season_meta(data, fixtures)
+    meta['source'] = list(key)
+
+    path = binary_snapshot_path(key)
+    write_binary_snapshot(path, arrays, meta)
+
+    return path
+
+
+def open_snapshot(key):
+    # Memory map the binary snapshot if it was built from these JSON files
+    path = binary_snapshot_path(key)
+    try:
+        meta, arrays = read_binary_snapshot(path)
+        if meta.get('source') == list(key):
+            return Snapshot(key, arrays, meta)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    data, fixtures = read_json(key)
+    arrays = model.build_season_arrays(data, fixtures)
+    meta = model.season_meta(data, fixtures)
+    meta['source'] = list(key)
+
+    # Save it for the other workers and the next start up, not required to serve this snapshot
+    # Once saved it is served from the file like any other, so every process shares the same pages and the
+    # parsed JSON is not kept (it is parsed again if data or fixtures are used)
+    try:
+        write_binary_snapshot(path, arrays, meta)
+        saved_meta, saved_arrays = read_binary_snapshot(path)
+        if saved_meta.get('source') == list(key):
+            return Snapshot(key, saved_arrays, saved_meta)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    for value in arrays.values():
+        value.setflags(write=False)
+
+    return Snapshot(key, arrays, meta, data=freeze(data), fixtures=freeze(fixtures))
+
+
+# Remove the binary snapshots of older data files, processes still serving one keep their memory map of it
+def remove_old_snapshots(keep):
+    try:
+        names = os.listdir(SNAPSHOT_DIR)
+    except OSError:
+        return
+
+    for name in names:
+        path = os.path.join(SNAPSHOT_DIR, name)
+        if name.endswith('.snap') and path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Register a function to call with each new snapshot before it is served, e.g. to precompute derived data
+def on_load(callback):
+    _on_load.append(callback)
+    return callback
+
+
+# Forget the current snapshot, the next get_snapshot opens it again and runs the on_load callbacks
+def reset():
+    global _current
+
+    with _lock:
+        _current = None
+
+
+# Current snapshot, reloaded when a newer (or rewritten) data file appears
+def get_snapshot():
+    global _current
+
+    key = snapshot_key()
+    current = _current
+    if current is not None and current.key == key:
+        return current
+
+    with _lock:
+        # Another thread may have loaded it while we waited
+        if _current is not None and _current.key == key:
+            return _current
+
+        try:
+            snapshot = open_snapshot(key)
+            in_progress = snapshot_key() != key
+        except (ValueError, OSError):
+            snapshot = None
+            in_progress = True
+
+        # A file is still being written, keep serving the previous snapshot until it settles
+        if in_progress:
+            if _current is not None:
+                return _current
+            if snapshot is None:
+                snapshot = open_snapshot(key)
+            return snapshot
+
+        for callback in _on_load:
+            try:
+                callback(snapshot)
+            except Exception:
+                # Derived data is computed again on first use
+                traceback.print_exc()
+
+        _current = snapshot
+        remove_old_snapshots(binary_snapshot_path(key))
+
+    return snapshot
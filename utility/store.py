@@ -0,0 +1,291 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+import pandas as pd
+
+from utility import metrics
+
+RESULT_STORE_PATH = os.environ.get('FPL_RESULT_STORE', 'cache/result_store.sqlite')
+RESULT_STORE_TTL = int(os.environ.get('FPL_RESULT_STORE_TTL', 3600))
+
+# Calculation results kept on disk for all worker processes and restarts, 0 bytes turns it off
+DISK_CACHE_PATH = os.environ.get('FPL_DISK_CACHE', 'cache/result_cache.sqlite')
+DISK_CACHE_BYTES = int(os.environ.get('FPL_DISK_CACHE_BYTES', 256 * 1024 * 1024))
+
+# Seconds between updates of an entry's last use, so most reads do not write
+DISK_CACHE_TOUCH_INTERVAL = 60
+
+
+result_store_lookups = metrics.Counter('fpl_result_store_lookups_total',
+                                       'Result store lookups by result (hit if every requested part was found, miss '
+                                       'or error)', ['result'])
+disk_cache_lookups = metrics.Counter('fpl_disk_cache_lookups_total',
+                                     'Disk cache lookups by result (hit, miss or error)', ['result'])
+
+
+# SQLite connection for concurrent use by several processes, statements run in autocommit mode
+def connect(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+# Values are stored as compressed pickles
+def encode(value):
+    return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def decode(content):
+    return pickle.loads(zlib.decompress(content))
+
+
+# SQLite file shared by the worker processes, schema is an SQL script run on each new connection
+class SQLiteStore:
+    schema = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    # Connection of this thread and process (connections must not cross a fork)
+    def _connection(self):
+        local = self._local
+        connection = getattr(local, 'connection', None)
+        if connection is not None and local.pid == os.getpid():
+            return connection
+
+        connection = connect(self.path)
+        connection.executescript(self.schema)
+        local.connection = connection
+        local.pid = os.getpid()
+        return connection
+
+
+# Key for a result, the same in every worker process for the same snapshot and parameters
+def result_key(snapshot_id, params):
+    return hashlib.sha1(repr((snapshot_id, params)).encode()).hexdigest()[:24]
+
+
+# Result parts shared between worker processes through a SQLite file, each part expires after ttl seconds
+# A failing disk stores nothing and finds nothing, the callers keep the result elsewhere or calculate it again
+class ResultStore(SQLiteStore):
+    schema = '''
+        CREATE TABLE IF NOT EXISTS result_part (
+            result_key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            expires REAL NOT NULL,
+            value BLOB NOT NULL,
+            PRIMARY KEY (result_key, name));
+        CREATE INDEX IF NOT EXISTS result_part_expires ON result_part (expires);
+    '''
+
+    def __init__(self, path=RESULT_STORE_PATH, ttl=RESULT_STORE_TTL):
+        super().__init__(path)
+        self.ttl = ttl
+        self._last_purge = 0
+
+    # Parts already stored under the key are the same, they are not written again, only kept from expiring
+    # (once they are half way there, so repeated puts of a result mostly only read). Returns False if the parts
+    # could not be stored.
+    @metrics.timed('result_store_put')
+    def put(self, result_key, parts):
+        now = time.time()
+        try:
+            connection = self._connection()
+            stored, expires = connection.execute('SELECT COUNT(*), MIN(expires) FROM result_part '
+                                                 'WHERE result_key = ? AND expires > ?', (result_key, now)).fetchone()
+            if stored == len(parts):
+                if expires < now + self.ttl / 2:
+                    connection.execute('UPDATE result_part SET expires = ? WHERE result_key = ?',
+                                       (now + self.ttl, result_key))
+            else:
+                rows = [(result_key, name, now + self.ttl, encode(value)) for name, value in parts.items()]
+                connection.executemany('INSERT INTO result_part VALUES (?, ?, ?, ?) ON CONFLICT (result_key, name) '
+                                       'DO UPDATE SET expires = excluded.expires', rows)
+
+            # Remove expired parts every so often
+            if now - self._last_purge > self.ttl / 10:
+                self._last_purge = now
+                connection.execute('DELETE FROM result_part WHERE expires <= ?', (now,))
+        except sqlite3.Error:
+            return False
+
+        return True
+
+    # Requested parts of a result, or None if any of them has expired or cannot be read
+    @metrics.timed('result_store_get')
+    def get(self, result_key, names):
+        names = list(names)
+        placeholders = ', '.join('?' * len(names))
+        try:
+            rows = self._connection().execute(
+                f'SELECT name, value FROM result_part WHERE result_key = ? AND expires > ? AND name IN ({placeholders})',
+                [result_key, time.time()] + names).fetchall()
+        except sqlite3.Error:
+            result_store_lookups.inc('error')
+            return None
+
+        if len(rows) != len(set(names)):
+            result_store_lookups.inc('miss')
+            return None
+
+        try:
+            parts = {name: decode(value) for name, value in rows}
+        except Exception:
+            result_store_lookups.inc('error')
+            self.delete(result_key)
+            return None
+
+        result_store_lookups.inc('hit')
+        return parts
+
+    def delete(self, result_key):
+        try:
+            self._connection().execute('DELETE FROM result_part WHERE result_key = ?', (result_key,))
+        except sqlite3.Error:
+            pass
+
+
+# Calculation results shared between worker processes through a SQLite file, kept across restarts
+# Keys are tuples starting with the snapshot ID, values are stored as compressed pickles. The least recently used
+# values are dropped once the file holds more than max_bytes of values. Values stored under another version (of the
+# code calculating them) are never read and are dropped with the older snapshots'.
+class DiskCache(SQLiteStore):
+    schema = '''
+        CREATE TABLE IF NOT EXISTS cache_entry (
+            key TEXT PRIMARY KEY,
+            snapshot TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL,
+            value BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS cache_entry_last_used ON cache_entry (last_used);
+        CREATE INDEX IF NOT EXISTS cache_entry_snapshot ON cache_entry (snapshot);
+
+        -- Total size of the values, kept up to date by the triggers below
+        CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+        INSERT OR IGNORE INTO cache_size VALUES (0, 0);
+        CREATE TRIGGER IF NOT EXISTS cache_entry_insert AFTER INSERT ON cache_entry BEGIN
+            UPDATE cache_size SET bytes = bytes + NEW.size;
+        END;
+        CREATE TRIGGER IF NOT EXISTS cache_entry_update AFTER UPDATE OF size ON cache_entry BEGIN
+            UPDATE cache_size SET bytes = bytes + NEW.size - OLD.size;
+        END;
+        CREATE TRIGGER IF NOT EXISTS cache_entry_delete AFTER DELETE ON cache_entry BEGIN
+            UPDATE cache_size SET bytes = bytes - OLD.size;
+        END;
+    '''
+
+    def __init__(self, path=DISK_CACHE_PATH, max_bytes=DISK_CACHE_BYTES, version=0):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.version = version
+
+    def _key(self, key):
+        return hashlib.sha1(repr((self.version, key)).encode()).hexdigest()
+
+    # Cached value, or None. A failing disk or a value that cannot be read (corrupt, or pickled by an incompatible
+    # version of the code) is a miss, the value is calculated instead.
+    @metrics.timed('disk_cache_get')
+    def get(self, key):
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute('SELECT value, last_used FROM cache_entry WHERE key = ?',
+                                     (self._key(key),)).fetchone()
+            if row is not None and now - row[1] > DISK_CACHE_TOUCH_INTERVAL:
+                connection.execute('UPDATE cache_entry SET last_used = ? WHERE key = ?', (now, self._key(key)))
+        except sqlite3.Error:
+            disk_cache_lookups.inc('error')
+            return None
+
+        if row is None:
+            disk_cache_lookups.inc('miss')
+            return None
+
+        try:
+            value = decode(row[0])
+        except Exception:
+            disk_cache_lookups.inc('error')
+            self.delete(key)
+            return None
+
+        disk_cache_lookups.inc('hit')
+        return value
+
+    @metrics.timed('disk_cache_put')
+    def put(self, key, value):
+        content = encode(value)
+        if len(content) > self.max_bytes:
+            return
+
+        try:
+            connection = self._connection()
+            connection.execute('INSERT INTO cache_entry VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                               'size = excluded.size, last_used = excluded.last_used, value = excluded.value',
+                               (self._key(key), str(key[0]), self.version, len(content), time.time(), content))
+            self.evict(connection)
+        except sqlite3.Error:
+            pass
+
+    # Drop the least recently used values until the rest fit in max_bytes
+    def evict(self, connection=None):
+        connection = connection or self._connection()
+        if connection.execute('SELECT bytes FROM cache_size').fetchone()[0] <= self.max_bytes:
+            return
+
+        connection.execute('DELETE FROM cache_entry WHERE key IN ('
+                           'SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS kept '
+                           'FROM cache_entry) WHERE kept > ?)', (self.max_bytes,))
+
+    def delete(self, key):
+        try:
+            self._connection().execute('DELETE FROM cache_entry WHERE key = ?', (self._key(key),))
+        except sqlite3.Error:
+            pass
+
+    # Drop the values of every snapshot but the one given and of other versions, they are never read again
+    def purge(self, snapshot_id):
+        try:
+            self._connection().execute('DELETE FROM cache_entry WHERE snapshot != ? OR version != ?',
+                                       (str(snapshot_id), self.version))
+        except sqlite3.Error:
+            pass
+
+    def size(self):
+        return self._connection().execute('SELECT bytes FROM cache_size').fetchone()[0]
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entry')
+
+
+# Split a complimenting_fixtures_calc result into the parts each callback needs
+# The fixtures of each team only depend on the snapshot and KPI, they are prepared again from the snapshot instead
+def result_parts(result):
+    fixture_pair, _, _, _, _, _, all_fixture_vals = result
+
+    parts = {'fixtures_pair': fixture_pair}
+    for team in all_fixture_vals:
+        parts[f'all_fixture_vals/{team}'] = all_fixture_vals[team]
+
+    return parts
+
+
+# Result parts as JSON for the hidden-data store, when they cannot be kept server side
+def parts_to_json(parts):
+    return {name: value.to_json(orient='split') for name, value in parts.items()}
+
+
+def parts_from_json(parts, names):
+    return {name: pd.read_json(parts[name], orient='split', typ='frame' if name == 'fixtures_pair' else 'series')
+            for name in names}
@@ -0,0 +1,157 @@
+import itertools
+import os
+import threading
+import traceback
+
+from flask import g
+
+from utility import functions, metrics, model, snapshot
+
+# Warm the caches in the background at start up and for each new snapshot
+WARMUP = os.environ.get('FPL_WARMUP', '1') not in ('', '0')
+
+# The app is loaded before the server forks its workers (set by gunicorn.conf.py)
+PRELOAD = os.environ.get('FPL_PRELOAD', '') not in ('', '0')
+
+warmup_tasks = metrics.Counter('fpl_warmup_tasks_total', 'Warm-up calculations by result', ['result'])
+
+_lock = threading.Lock()
+_wake = threading.Condition(_lock)
+_pending = None
+_foreground = 0
+_pid = None
+
+
+# Parameters of the default view of each built-in KPI, with and without multi and blank gameweeks,
+# then the comparison of every pair of teams in the default view
+def tasks(season):
+    start_gameweek, end_gameweek = functions.default_window(season.meta['n_gameweeks'],
+                                                            season.meta['next_gameweek'])
+    teams = season.meta['teams']
+    custom_kpi = {team: 0 for team in teams}
+
+    for kpi in model.KPIS:
+        for skip_multi_gameweeks, skip_blank_gameweeks in itertools.product((False, True), repeat=2):
+            yield functions.complimenting_fixtures_calc, (kpi, custom_kpi, start_gameweek, end_gameweek, [],
+                                                          skip_multi_gameweeks, skip_blank_gameweeks)
+
+    # In dropdown order, e.g. ARS v AVL rather than AVL v ARS, as many as the result cache keeps alongside the above
+    pairs = itertools.combinations(teams, 2)
+    if functions.result_cache.max_entries is not None:
+        pairs = itertools.islice(pairs, max(functions.result_cache.max_entries - 4 * len(model.KPIS), 0))
+    for team1, team2 in pairs:
+        yield functions.compare_teams, ('difficulty', custom_kpi, start_gameweek, end_gameweek, [], False, False,
+                                        team1, team2)
+
+
+# Warm up for this snapshot, replacing any warm-up still running for an older one
+def schedule(season):
+    global _pending
+
+    with _wake:
+        _pending = season
+        _wake.notify_all()
+    return season
+
+
+def _run():
+    global _pending
+
+    while True:
+        with _wake:
+            while _pending is None:
+                _wake.wait()
+            season = _pending
+            _pending = None
+
+        for function, args in tasks(season):
+            with _wake:
+                # Foreground requests go first, a newer snapshot replaces this warm-up
+                while _foreground and _pending is None:
+                    _wake.wait()
+                if _pending is not None:
+                    break
+
+            # Only warm the snapshot being served
+            if snapshot.get_snapshot() is not season:
+                break
+
+            _run_task(function, args)
+
+
+def _run_task(function, args):
+    try:
+        function(*args)
+        warmup_tasks.inc('done')
+    except Exception:
+        warmup_tasks.inc('error')
+        traceback.print_exc()
+
+
+# Warm up for a snapshot in this thread, e.g. in a pre-fork server's master process so every worker starts warm
+def warm(season):
+    for function, args in tasks(season):
+        _run_task(function, args)
+
+
+# Start the warm-up thread of this process (threads do not survive a fork, so again in each worker)
+def start():
+    global _pid
+
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+
+    threading.Thread(target=_run, name='fpl-warmup', daemon=True).start()
+    schedule(snapshot.get_snapshot())
+
+
+# Locks may have been held by the parent's warm-up thread when the process forked
+def _after_fork():
+    global _lock, _wake, _pending, _foreground, _pid
+
+    _lock = threading.Lock()
+    _wake = threading.Condition(_lock)
+    _pending = None
+    _foreground = 0
+    _pid = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _begin_request():
+    global _foreground
+
+    if _pid != os.getpid():
+        start()
+    with _wake:
+        _foreground += 1
+    g.fpl_foreground = True
+
+
+def _end_request(exc=None):
+    global _foreground
+
+    if not g.pop('fpl_foreground', False):
+        return
+    with _wake:
+        _foreground -= 1
+        _wake.notify_all()
+
+
+# Warm the caches of a Flask server's process, pausing while it serves requests
+# With preload (the app is loaded before the server forks its workers) the current snapshot is warmed up front
+# instead, no thread may be running at the fork. Each worker starts its own thread with its first request.
+def init_app(server):
+    if not WARMUP:
+        return
+
+    server.before_request(_begin_request)
+    server.teardown_request(_end_request)
+    snapshot.on_load(schedule)
+    if PRELOAD:
+        warm(snapshot.get_snapshot())
+    else:
+        start()